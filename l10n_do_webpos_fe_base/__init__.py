@@ -1,3 +1,4 @@
+from . import controllers
 from . import models
 from .hook import post_init_hook  # Importa el hook
 
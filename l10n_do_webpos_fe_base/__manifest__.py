@@ -8,7 +8,7 @@
     "license": "OPL-1",
     "support": "soporte@intrepidux.com",
     'category': 'Localization',
-    'version': "17.0.1.0.24",
+    'version': "17.0.1.0.28",
 
     # any module necessary for this one to work correctly
     'depends': ['base','account','account_debit_note','l10n_do_accounting'],
@@ -16,6 +16,7 @@
     # always loaded
    'data': [
          'security/ir.model.access.csv',
+        'security/ir_rule.xml',
         'views/account_payment_inherit.xml',
         'views/account_journal_inherit.xml',
         'views/account_tax_inherit.xml',
@@ -24,8 +25,12 @@
         'views/account_move_inherit.xml',
         'views/res_company_inherit.xml',
         'views/xml_data_logs_menu.xml',
+        'views/xml_data_archive.xml',
+        'views/xml_data_event.xml',
+        'views/ecf_export_wizard.xml',
         'views/fe_webpos_navigation.xml',
         'data/account_webpos_data.xml',
+        'data/ir_cron_data.xml',
     ],
     # "post_init_hook": "post_init_hook", //revisar maximo recursions en actualizacion odoo sh
 
@@ -0,0 +1,114 @@
+import gzip
+import logging
+import os
+
+from werkzeug.exceptions import NotFound
+
+from odoo import _, http
+from odoo.exceptions import MissingError
+from odoo.http import request, Stream
+
+_logger = logging.getLogger(__name__)
+
+
+class WebposDocumentController(http.Controller):
+
+    # payload de la URL -> (campo de my.xml.data, mimetype, sufijo del nombre de archivo)
+    _PAYLOADS = {
+        'xml': ('xml_data', 'application/xml', '.xml'),
+        'xml_ecf': ('xml', 'application/xml', '_ecf.xml'),
+        'xml_webpos': ('xml_webpos', 'application/xml', '_webpos.xml'),
+        'json': ('json_response', 'application/json', '.json'),
+        'json_sent': ('json_response_sent', 'application/json', '_envio.json'),
+        'pdf': ('pdf', 'application/pdf', '.pdf'),
+    }
+
+    def _get_document(self, document_id):
+        document = request.env['my.xml.data'].browse(document_id).exists()
+        if not document:
+            raise NotFound()
+        document.check_access_rights('read')
+        document.check_access_rule('read')
+        return document
+
+    def _get_payload_stream(self, document, payload):
+        """Build the download stream of a payload straight from its filestore attachment.
+
+        The text payloads are stored gzip-compressed: clients that accept gzip
+        get the stored file as is (``Content-Encoding: gzip``), the others get
+        it decompressed. Returns ``(stream, gzip_encoded)``.
+        """
+        fname, mimetype, suffix = self._PAYLOADS[payload]
+        download_name = f'{document.name or document.id}{suffix}'
+        blob_fname = document._PAYLOAD_FIELDS.get(fname)
+        if fname == 'pdf':
+            document._ensure_pdf()
+        if not blob_fname:
+            return request.env['ir.binary']._get_stream_from(
+                document, fname, filename=download_name, mimetype=mimetype), False
+        if document.archive_id and not document.with_context(bin_size=True)[blob_fname]:
+            # Documento archivado: el payload sale del almacenamiento en frio
+            content = document.archive_id._get_payloads().get(fname)
+            if not content:
+                raise MissingError(_('No hay datos para descargar.'))
+            data = content.encode('utf-8')
+            return Stream(type='data', data=data, size=len(data), mimetype=mimetype,
+                          download_name=download_name), False
+
+        stream = request.env['ir.binary']._get_stream_from(
+            document, blob_fname, filename=download_name, mimetype=mimetype)
+        if request.httprequest.accept_encodings['gzip']:
+            stream.etag = f'{stream.etag}-gzip' if stream.etag else stream.etag
+            return stream, True
+        data = gzip.decompress(stream.read())
+        return Stream(
+            type='data',
+            data=data,
+            size=len(data),
+            mimetype=mimetype,
+            download_name=download_name,
+            etag=stream.etag,
+            last_modified=stream.last_modified,
+            conditional=True,
+        ), False
+
+    @http.route('/webpos_fe/document/<int:document_id>/<string:payload>', type='http', auth='user')
+    def download_document_payload(self, document_id, payload, download=True, **kwargs):
+        """Stream a raw payload of a my.xml.data document.
+
+        No base64 round trip: the bytes come from the filestore, with ETag,
+        Last-Modified and Range support handled by ``Stream``.
+        """
+        if payload not in self._PAYLOADS:
+            raise NotFound()
+        document = self._get_document(document_id)
+        try:
+            stream, gzip_encoded = self._get_payload_stream(document, payload)
+        except MissingError:
+            raise NotFound()
+        response = stream.get_response(as_attachment=str(download).lower() not in ('0', 'false'))
+        if gzip_encoded:
+            response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
+        return response
+
+    @http.route('/webpos_fe/export/<int:export_id>/download', type='http', auth='user')
+    def download_export(self, export_id, **kwargs):
+        """Serve the ZIP of a finished webpos.ecf.export straight from disk."""
+        export = request.env['webpos.ecf.export'].browse(export_id).exists()
+        if not export:
+            raise NotFound()
+        export.check_access_rights('read')
+        export.check_access_rule('read')
+        path = export._get_file_path()
+        if export.state != 'done' or not os.path.exists(path):
+            raise NotFound()
+        stream = Stream(
+            type='path',
+            path=path,
+            mimetype='application/zip',
+            download_name=export.name,
+            size=os.path.getsize(path),
+            last_modified=export.date_done,
+        )
+        return stream.get_response(as_attachment=True)
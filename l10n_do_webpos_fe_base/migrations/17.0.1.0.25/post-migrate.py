@@ -0,0 +1,47 @@
+import logging
+
+from odoo import SUPERUSER_ID, api
+from odoo.tools.sql import column_exists
+
+_logger = logging.getLogger(__name__)
+
+# Columnas antiguas de my_xml_data que ahora viven en adjuntos del filestore
+_PAYLOAD_COLUMNS = ('xml_data', 'xml', 'xml_webpos', 'json_response', 'json_response_sent', 'pdf')
+_BATCH_SIZE = 500
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    columns = [column for column in _PAYLOAD_COLUMNS if column_exists(cr, 'my_xml_data', column)]
+    if not columns:
+        return
+
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    XmlData = env['my.xml.data'].with_context(active_test=False)
+    cr.execute(
+        "SELECT id FROM my_xml_data WHERE %s ORDER BY id"
+        % " OR ".join(f'"{column}" IS NOT NULL' for column in columns)
+    )
+    ids = [row[0] for row in cr.fetchall()]
+    _logger.info("Moviendo el contenido de %s documentos my.xml.data al filestore", len(ids))
+
+    for start in range(0, len(ids), _BATCH_SIZE):
+        batch_ids = ids[start:start + _BATCH_SIZE]
+        cr.execute(
+            "SELECT id, %s FROM my_xml_data WHERE id IN %%s" % ", ".join(f'"{column}"' for column in columns),
+            [tuple(batch_ids)],
+        )
+        for row in cr.fetchall():
+            vals = {}
+            for column, value in zip(columns, row[1:]):
+                if value is None:
+                    continue
+                # El bytea del Binary antiguo ya contiene el valor en base64
+                vals[column] = bytes(value) if column == 'pdf' else value
+            XmlData.browse(row[0]).write(vals)
+        env.flush_all()
+        env.invalidate_all()
+
+    for column in columns:
+        cr.execute(f'ALTER TABLE my_xml_data DROP COLUMN "{column}"')
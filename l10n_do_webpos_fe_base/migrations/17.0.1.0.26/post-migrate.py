@@ -0,0 +1,17 @@
+import logging
+
+from odoo.tools.sql import column_exists
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version or not column_exists(cr, 'account_move', 'xml_data'):
+        return
+    # account.move.xml_data ya no se almacena, el XML vive solo en my.xml.data.
+    # Vaciar la columna antes de eliminarla deja sus tuplas TOAST como muertas,
+    # de modo que el autovacuum normal recupera el espacio; DROP COLUMN por si
+    # solo no libera nada hasta que se reescriba la tabla.
+    cr.execute("UPDATE account_move SET xml_data = NULL WHERE xml_data IS NOT NULL")
+    _logger.info("Liberado el XML almacenado en %s asientos contables", cr.rowcount)
+    cr.execute("ALTER TABLE account_move DROP COLUMN xml_data")
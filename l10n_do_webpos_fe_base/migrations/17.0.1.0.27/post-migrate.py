@@ -0,0 +1,13 @@
+def migrate(cr, version):
+    if not version:
+        return
+    # Los PDF ya almacenados entran en la cache con su tamaño real, para que
+    # cuenten en el limite de webpos_api.pdf_cache_max_mb
+    cr.execute("""
+        UPDATE my_xml_data d
+           SET pdf_size = a.file_size
+          FROM ir_attachment a
+         WHERE a.res_model = 'my.xml.data'
+           AND a.res_field = 'pdf'
+           AND a.res_id = d.id
+    """)
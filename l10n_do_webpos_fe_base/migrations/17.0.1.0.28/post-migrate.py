@@ -0,0 +1,11 @@
+def migrate(cr, version):
+    if not version:
+        return
+    # Los eventos conservan el nombre del documento, que sobrevive a su borrado
+    cr.execute("""
+        UPDATE my_xml_data_event e
+           SET document_name = d.name
+          FROM my_xml_data d
+         WHERE d.id = e.document_id
+           AND e.document_name IS NULL
+    """)
@@ -3,10 +3,19 @@ from . import account_payment_inherit
 from . import account_payment_register_inherit
 from . import account_move_inherit
 from . import account_tax_inherit
+from . import l10n_latam_document_type_inherit
 
 from . import fe_credential #pendiente a actualizar
 
+from . import webpos_api_client
+from . import ecf_xml_engine
 from . import my_xml_data #pendiente a actualizar
+from . import my_xml_data_summary
+from . import my_xml_data_version
+from . import my_xml_data_event
+from . import my_xml_data_archive
+from . import ecf_export
+from . import ecf_export_wizard
 # from . import webpos_document #pendiente a actualizar
 # from . import pos_order
 # from . import sale_order_inherit
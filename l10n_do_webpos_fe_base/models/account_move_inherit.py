@@ -2,15 +2,21 @@
 
 import io
 import os
+import re
 import requests
-import json
-from odoo import api, fields, models, _
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import UserError
 
 import logging
 _logger = logging.getLogger(__name__)
 
-import datetime
+# Prefijos del NCF en orden de prioridad: tipo completo (E31, B02), codigo corto (FF, FC...) y codigo numerico (31)
+_NCF_PREFIX_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'^(E\d{2}|B\d{2})',
+    r'^(FF|FC|D|C|P|E|FE|FG|FX|PY)',
+    r'^(\d{2})',
+))
+
 # from odoo.addons.l10n_do_webpos_fe_base.utils.xml_base import XmlInterface # Old import, removed as logic moved to webpos_api
 
 
@@ -86,7 +92,6 @@ class AccountMove(models.Model):
     # pos_order_ids = fields.One2many('pos.order', 'account_move')
     # pos_payment_ids = fields.One2many('pos.payment', 'account_move_id')
  
-    xml_data = fields.Text('XML Data')
     xml_data_ids = fields.One2many('my.xml.data', 'account_move_id', string='XML Data ids') #pendiente eliminar
 
 
@@ -95,7 +100,8 @@ class AccountMove(models.Model):
     # campos de my.xml.data mapeo
     # Los campos serán accesibles a través de my_xml_data_id
     xml_name = fields.Char(related='xml_data_id.name', string='Name XML', store=True)
-    xml_data = fields.Text(related='xml_data_id.xml_data', string='XML Data', store=True)
+    # Sin store: el XML se lee bajo demanda desde my.xml.data y no ensancha account_move
+    xml_data = fields.Text(related='xml_data_id.xml_data', string='XML Data')
     status = fields.Selection(related='xml_data_id.status', string='WebPosStatus', store=True)
     dgi_status = fields.Char(related='xml_data_id.dgi_status', string='Estado DGII', store=True)
     dgi_err_msg = fields.Text(related='xml_data_id.dgi_err_msg', string='Error Message', store=True)
@@ -105,34 +111,14 @@ class AccountMove(models.Model):
 
     def _get_api_base_url(self):
         """Get the API base URL from system parameters"""
-        return self.env['ir.config_parameter'].sudo().get_param('webpos_api.base_url', 'http://localhost:8069')
+        return self.env['webpos.api.client']._get_base_url()
 
     def _call_webpos_api(self, endpoint, data):
         """Make a JSON-RPC call to the webpos_api endpoints"""
         try:
-            base_url = self._get_api_base_url()
-            url = f"{base_url}{endpoint}"
-            
-            # Prepare JSON-RPC format
-            jsonrpc_data = {
-                "jsonrpc": "2.0",
-                "method": "call",
-                "params": data,
-                "id": 1
-            }
-            
-            headers = {
-                'Content-Type': 'application/json',
-            }
-            
-            _logger.info(f"Making API call to: {url}")
-            _logger.info(f"JSON-RPC Data: {json.dumps(jsonrpc_data, indent=2)}")
-            
-            response = requests.post(url, json=jsonrpc_data, headers=headers, timeout=30)
-            response.raise_for_status()
-            
-            return response.json()
-            
+            _logger.info(f"Making API call to: {endpoint}")
+            return self.env['webpos.api.client']._post(endpoint, data)
+
         except requests.exceptions.RequestException as e:
             _logger.error(f"API call to {endpoint} failed: {str(e)}")
             raise UserError(_('Error calling WebPOS API: %s') % str(e))
@@ -168,53 +154,63 @@ class AccountMove(models.Model):
         return xml_data
 
 
+    def _is_webpos_ecf_to_send(self):
+        """Whether posting this invoice must produce an e-CF for webpos_api."""
+        self.ensure_one()
+        return bool(
+            self.is_ecf_invoice and self.journal_id.is_webpos
+            and self.l10n_do_fiscal_number and self.journal_id.l10n_latam_use_documents
+            and self.move_type in ('out_invoice', 'in_invoice', 'out_refund', 'out_debit')
+        )
+
+    def _enqueue_ecf(self):
+        """Create the pending my.xml.data outbox jobs for these invoices.
+
+        XML generation, sending and verification are done by the outbox
+        cron (see ``my.xml.data._cron_process_outbox``), so posting does not
+        wait on webpos_api, not even while it is down.
+
+        An invoice posted again after a reset to draft reuses its unsent
+        job, so one eNCF never has two jobs in the queue.
+        """
+        # Con webpos_api caido el documento queda en contingencia y se envia al recuperarse
+        status = 'contingency' if self.env['webpos.api.client']._is_circuit_open() else 'pending'
+        XMLData = self.env['my.xml.data']
+        reused = self.filtered(lambda invoice: invoice.xml_data_id.account_move_id == invoice
+                               and invoice.xml_data_id.status in XMLData._REQUEUE_STATUSES)
+        for invoice in reused:
+            # El XML pudo generarse antes de volver a borrador: se genera de nuevo
+            invoice.xml_data_id.write({
+                'name': invoice.l10n_latam_document_number,
+                'xml_data': False,
+                'payload_fingerprint': False,
+                'status': status,
+                'error': False,
+                'queue_attempts': 0,
+            })
+        to_create = self - reused
+        jobs = XMLData.create([{
+            'name': invoice.l10n_latam_document_number,
+            'xml_data': False,
+            'account_move_id': invoice.id,
+            'company_id': invoice.company_id.id,
+            'status': status,
+        } for invoice in to_create])
+        for invoice, job in zip(to_create, jobs):
+            invoice.xml_data_id = job
+        jobs = reused.xml_data_id | jobs
+        jobs._trigger_outbox()
+        return jobs
+
     def action_post(self):
         # Llamar al método original
         res = super(AccountMove, self).action_post()
-        invoice = self.env['account.move'].browse(self.id)
-        _logger.error("<-- print_invoice  action_post()--> %s", invoice) 
 
-
-        # Lógica adicional después de confirmar la factura
-     
-        for invoice in self:
-            _logger.error("<-- print_invoice antes de 108-->")
-            _logger.error(f"Debug condition: invoice.is_ecf_invoice = {invoice.is_ecf_invoice}")
-            _logger.error(f"Debug condition: invoice.journal_id.is_webpos = {invoice.journal_id.is_webpos}")
-            _logger.error(f"Debug condition: not invoice.l10n_do_fiscal_number = {not invoice.l10n_do_fiscal_number}")
-            _logger.error(f"Debug value : invoice.l10n_do_fiscal_number = {invoice.l10n_do_fiscal_number}")
-            _logger.error(f"Debug condition: Full condition result = {(invoice.is_ecf_invoice and invoice.journal_id.is_webpos) and (invoice.l10n_do_fiscal_number)}")
-            if (invoice.is_ecf_invoice and invoice.journal_id.is_webpos) and (invoice.l10n_do_fiscal_number and invoice.journal_id.l10n_latam_use_documents):
-                _logger.error("<-- print_invoice despues de 1108 IF -->")
-                if invoice.move_type in ('out_invoice', 'in_invoice', 'out_refund', 'out_debit'):
-                    doc_type = self.doc_type_E(invoice) # Pass the invoice object
-                    xml_content, xml_name = self.build_xml_to_print(invoice, doc_type)
-                    xml_data = xml_content  # Generar el XML
-
-                    
-
-                
-                    # # Es factura de compras y  no se genera documentos electronico ( venta proveedor)
-                    # if (invoice.move_type in 'in_invoice') and self.doc_type_E(self.l10n_latam_document_number) in ("31","32"):
-                    #     # Es factura de compras y  no se genera documentos electronico ( venta proveedor)
-                    #     # Crear el documento EDI
-                    #     _logger.error("<-- NO GENERA comprobante -->")
-                    # else:
-                    try:
-                    # Llama al método con el contenido XML
-                    
-                        execute_EF = invoice.create_xml_data(invoice, xml_data)
-                        
-                        #Activar envio diferido, apaga envio automatico  para envaluar documentos antes de ser enviados
-                        execute_EF.save_and_send_xml()
-                        execute_EF.verify_sent_encf()
-
-                    except Exception as e:
-                        raise UserError(_('Error al crear el documento Electronico: %s' % str(e)))
-                        
-                    # Print XML to standard output using the new API approach
-                    self.xml_print_to_std(xml_content)
-                
+        # Solo se encola el documento electronico, el envio lo hace la cola (ir.cron)
+        invoices = self.filtered(lambda inv: inv._is_webpos_ecf_to_send())
+        if invoices:
+            _logger.info("Encolando %s documentos electronicos: %s", len(invoices), invoices.ids)
+            invoices._enqueue_ecf()
 
         return res
 
@@ -341,103 +337,158 @@ class AccountMove(models.Model):
     #    _logger.error("<-- accountInvoice --> IT IS Error 4")
     #t    return inv
 
+    # Campos opcionales de la factura (los agregan otros modulos l10n_do) -> valor por defecto
+    _API_OPTIONAL_FIELDS = {
+        'withholded_itbis': 0.0,
+        'income_withholding': 0.0,
+        'aditional_info_invoice_header1': '',
+        'aditional_info_invoice_header2': '',
+    }
+
+    # Campos de pagos y credenciales que consume webpos_api: solo estos se leen y se envian
+    _API_PAYMENT_FIELDS = ('name', 'date', 'amount', 'currency_id', 'journal_id', 'payment_type', 'type_payment_id')
+    _API_CREDENTIAL_FIELDS = ('name', 'companyLicCod', 'branchCod', 'posCod')
+
     def _prepare_invoice_data_for_api(self, invoice):
         """Prepare comprehensive invoice data for API with robust error handling"""
+        return invoice._prepare_invoice_data_batch()[invoice.id]
+
+    def _prepare_invoice_data_batch(self):
+        """Build the webpos_api payload of every invoice in ``self`` at once.
+
+        Invoices, lines, partners, currencies, taxes, products, payments and
+        credentials are each read with a single ``read``, so the number of
+        queries does not grow with the number of invoices. Partner, currency
+        and tax sub-dicts are built once and shared by all the payloads.
+
+        :return: dict ``{invoice_id: {'record', 'lines', ...}}``
+        """
         try:
-            # Prepare partner data with comprehensive fallback
+            optional_fields = [fname for fname in self._API_OPTIONAL_FIELDS if fname in self._fields]
+            date_fields = [fname for fname in ('l10n_do_ncf_expiration_date', 'ncf_expiration_date') if fname in self._fields]
+            moves = self.read([
+                'invoice_date', 'l10n_latam_document_number', 'partner_id', 'currency_id', 'company_id',
+                'journal_id', 'reversed_entry_id', 'debit_origin_id', 'invoice_payments_widget',
+            ] + optional_fields + date_fields, load=None)
+
+            partners = self.partner_id
+            states = {state.id: state.name for state in partners.state_id}
+            countries = {country.id: country.name for country in partners.country_id}
             partner_data = {
-                'name': invoice.partner_id.name or '',
-                'vat': invoice.partner_id.vat or '',
-                'street': invoice.partner_id.street or '',
-                'state_name': invoice.partner_id.state_id.name if invoice.partner_id.state_id else '',
-                'country_name': invoice.partner_id.country_id.name if invoice.partner_id.country_id else '',
-                'email': invoice.partner_id.email or ''
+                partner['id']: {
+                    'name': partner['name'] or '',
+                    'vat': partner['vat'] or '',
+                    'street': partner['street'] or '',
+                    'state_name': states.get(partner['state_id'], ''),
+                    'country_name': countries.get(partner['country_id'], ''),
+                    'email': partner['email'] or '',
+                }
+                for partner in partners.read(['name', 'vat', 'street', 'state_id', 'country_id', 'email'], load=None)
             }
 
-            # Prepare currency data
+            no_partner = {'name': '', 'vat': '', 'street': '', 'state_name': '', 'country_name': '', 'email': ''}
+
+            lines = self.invoice_line_ids
             currency_data = {
-                'id': invoice.currency_id.id,
-                'name': invoice.currency_id.name or '',
-                'decimal_places': invoice.currency_id.decimal_places or 2,
-                'inverse_rate': invoice.currency_id.rate or 1.0
+                currency['id']: {
+                    'id': currency['id'],
+                    'name': currency['name'] or '',
+                    'decimal_places': currency['decimal_places'],
+                    'inverse_rate': currency['inverse_rate'] or 1.0,
+                }
+                for currency in (self.currency_id | lines.currency_id).read(['name', 'decimal_places', 'inverse_rate'])
             }
 
-            # Prepare company data with fallback
-            company_data = {}
-            if hasattr(invoice.company_id, 'fe_webpos_id') and invoice.company_id.fe_webpos_id:
-                company_data['fe_webpos_id'] = [{
-                    'name': invoice.company_id.name or 'TEST',
-                    'companyLicCod': invoice.company_id.fe_webpos_id[0].companyLicCod if invoice.company_id.fe_webpos_id else 'UNKNOWN',
-                    'branchCod': invoice.company_id.fe_webpos_id[0].branchCod if invoice.company_id.fe_webpos_id else '001',
-                    'posCod': invoice.company_id.fe_webpos_id[0].posCod if invoice.company_id.fe_webpos_id else '001'
-                }]
-
-            # Prepare invoice lines data
-            lines_data = []
-            for line in invoice.invoice_line_ids:
-                line_taxes = []
-                for tax in line.tax_ids:
-                    line_taxes.append({
-                        'name': tax.name or '',
-                        'amount': tax.amount or 0.0
-                    })
-
-                lines_data.append({
-                    'name': line.name or '',
-                    'quantity': line.quantity or 0.0,
-                    'price_unit': line.price_unit or 0.0,
-                    'price_subtotal': line.price_subtotal or 0.0,
-                    'price_total': line.price_total or 0.0,
-                    'tax_ids': line_taxes,
-                    'product_id': {
-                        'name': line.product_id.name or '',
-                        'default_code': line.product_id.default_code or False
-                    }
-                })
-
-            # Determine NCF expiration date with fallback
-            ncf_expiration_date = ''
-            if hasattr(invoice, 'l10n_do_ncf_expiration_date') and invoice.l10n_do_ncf_expiration_date:
-                ncf_expiration_date = invoice.l10n_do_ncf_expiration_date.strftime('%Y-%m-%d')
-            elif hasattr(invoice, 'ncf_expiration_date') and invoice.ncf_expiration_date:
-                ncf_expiration_date = invoice.ncf_expiration_date.strftime('%Y-%m-%d')
-
-            # Prepare main invoice record data
-            record_data = {
-                'invoice_date': invoice.invoice_date.strftime('%Y-%m-%d') if invoice.invoice_date else '',
-                'l10n_latam_document_number': invoice.l10n_latam_document_number or '',
-                'ncf_expiration_date': ncf_expiration_date,
-                'partner_id': partner_data,
-                'currency_id': currency_data,
-                'company_id': company_data,
-                'invoice_payments_widget': getattr(invoice, 'invoice_payments_widget', None),
-                'payment_ids': [],  # Add payment data if needed
-                'reversed_entry_id': invoice.reversed_entry_id.id if invoice.reversed_entry_id else None,
-                'debit_origin_id': invoice.debit_origin_id.id if invoice.debit_origin_id else None,
-                'lines': lines_data,
-                'withholded_itbis': getattr(invoice, 'withholded_itbis', 0.0),
-                'income_withholding': getattr(invoice, 'income_withholding', 0.0),
-                'aditional_info_invoice_header1': getattr(invoice, 'aditional_info_invoice_header1', ''),
-                'aditional_info_invoice_header2': getattr(invoice, 'aditional_info_invoice_header2', ''),
+            taxes = lines.tax_ids
+            tax_fields = [fname for fname in ('name', 'amount', 'price_include', 'tax_scope') if fname in taxes._fields]
+            tax_data = {
+                tax['id']: {
+                    'id': tax['id'],
+                    'name': tax['name'] or '',
+                    'amount': tax['amount'] or 0.0,
+                    'price_include': tax['price_include'],
+                    'tax_scope': tax.get('tax_scope') or '',
+                }
+                for tax in taxes.read(tax_fields)
             }
-
-            def clean_dates(obj):
-                if isinstance(obj, dict):
-                    return {k: clean_dates(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [clean_dates(i) for i in obj]
-                elif isinstance(obj, (datetime.date, datetime.datetime)):
-                    return obj.isoformat()
-                return obj
-
-            # Limpia fechas antes de serializar
-            record_data_clean = clean_dates(record_data)
-            lines_data_clean = clean_dates(lines_data)
-            _logger.error("API DATA: %s", json.dumps(record_data_clean, indent=2))
-            return {
-                'record': record_data_clean,
-                'lines': lines_data_clean,
+            product_data = {
+                product['id']: {
+                    'id': product['id'],
+                    'name': product['name'] or '',
+                    'default_code': product['default_code'] or '',
+                }
+                for product in lines.product_id.read(['name', 'default_code'])
             }
+            no_product = {'id': False, 'name': '', 'default_code': ''}
+
+            lines_data = {move['id']: [] for move in moves}
+            for line in lines.read([
+                'move_id', 'name', 'price_unit', 'quantity', 'discount', 'price_subtotal', 'price_total',
+                'product_id', 'currency_id', 'tax_ids',
+            ], load=None):
+                lines_data[line['move_id']].append({
+                    'name': line['name'] or '',
+                    'price_unit': line['price_unit'] or 0.0,
+                    'quantity': line['quantity'] or 0.0,
+                    'discount': line['discount'] or 0.0,
+                    'price_subtotal': line['price_subtotal'] or 0.0,
+                    'price_total': line['price_total'] or 0.0,
+                    'product_id': product_data.get(line['product_id'], no_product),
+                    'currency_id': currency_data.get(line['currency_id']),
+                    'tax_ids': [tax_data[tax_id] for tax_id in line['tax_ids']],
+                })
+
+            # Credenciales de cada compañia, una sola lectura para todas
+            credentials = {company.id: [] for company in self.company_id}
+            for credential in self.company_id.fe_webpos_id.read(list(self._API_CREDENTIAL_FIELDS) + ['company_id'], load=None):
+                credentials[credential.pop('company_id')].append(credential)
+
+            payments = {move['id']: [] for move in moves}
+            if 'payment_ids' in self._fields:
+                move_payments = {invoice.id: invoice.payment_ids.ids for invoice in self}
+                payment_values = {
+                    payment['id']: payment
+                    for payment in self.payment_ids.read(list(self._API_PAYMENT_FIELDS))
+                }
+                for move_id, payment_ids in move_payments.items():
+                    payments[move_id] = [payment_values[payment_id] for payment_id in payment_ids]
+
+            journal_expiration = {}
+            if 'l10n_do_ncf_expiration_date' in self.journal_id._fields:
+                journal_expiration = {
+                    journal['id']: journal['l10n_do_ncf_expiration_date']
+                    for journal in self.journal_id.read(['l10n_do_ncf_expiration_date'])
+                }
+
+            results = {}
+            for move in moves:
+                ncf_expiration_date = next(
+                    (move[fname] for fname in date_fields if move[fname]),
+                    journal_expiration.get(move['journal_id']),
+                )
+                record_data = {
+                    'invoice_date': move['invoice_date'].strftime('%Y-%m-%d') if move['invoice_date'] else '',
+                    'l10n_latam_document_number': move['l10n_latam_document_number'] or '',
+                    'ncf_expiration_date': ncf_expiration_date.strftime('%Y-%m-%d') if ncf_expiration_date else '',
+                    'partner_id': partner_data.get(move['partner_id'], no_partner),
+                    'currency_id': currency_data.get(move['currency_id']),
+                    'company_id': {'fe_webpos_id': credentials.get(move['company_id'], [])},
+                    # Las fechas se codifican al serializar la peticion (webpos_api_client._json_default)
+                    'invoice_payments_widget': move['invoice_payments_widget'],
+                    'payment_ids': payments[move['id']],
+                    'reversed_entry_id': move['reversed_entry_id'] or False,
+                    'debit_origin_id': move['debit_origin_id'] or False,
+                    'lines': lines_data[move['id']],
+                }
+                for fname, default in self._API_OPTIONAL_FIELDS.items():
+                    record_data[fname] = move.get(fname, default)
+                results[move['id']] = {
+                    'record': record_data,
+                    'lines': lines_data[move['id']],
+                    'origin_document_data': False,
+                    'current_user_login_data': False,
+                }
+            return results
 
         except Exception as e:
             _logger.error(f"Error preparing invoice data for API: {str(e)}")
@@ -445,6 +496,16 @@ class AccountMove(models.Model):
 
     def build_xml_to_print(self, invoice, type_document):
         """Generate XML using the webpos_api endpoint with comprehensive logging"""
+        xml_content, xml_name, fingerprint = self._build_xml_with_fingerprint(invoice, type_document)
+        return xml_content, xml_name
+
+    def _build_xml_with_fingerprint(self, invoice, type_document):
+        """Like :meth:`build_xml_to_print`, also returning the payload fingerprint.
+
+        Nothing is stored here: the caller saving the XML in my.xml.data
+        writes ``payload_fingerprint`` in the same ``write`` as ``xml_data``,
+        so a fingerprint never describes an XML that was not kept.
+        """
         try:
             # Prepare invoice data for the API
             _logger.info("Starting XML generation for invoice %s", invoice.id)
@@ -466,16 +527,26 @@ class AccountMove(models.Model):
             # Prepare invoice data for the API
             
             invoice_data = self._prepare_invoice_data_for_api(invoice)
-            
-            # Log the prepared invoice data for debugging
-            _logger.info("Prepared Invoice Data:")
-            _logger.info(json.dumps(invoice_data, indent=2))
+            # El payload ya no se vuelca al log: con cientos de lineas, serializarlo costaba mas que la llamada
+            _logger.debug("Prepared Invoice Data: %s lines", len(invoice_data.get('lines') or []))
             
             # Validate invoice data before API call
             if not invoice_data or not invoice_data.get('record'):
                 _logger.error("Invalid invoice data: Empty or missing record")
                 raise UserError(_('Invalid invoice data. Cannot generate XML.'))
             
+            # Si la factura no cambio desde la ultima generacion se reutiliza el XML almacenado
+            fingerprint = self.env['my.xml.data']._get_payload_fingerprint(
+                invoice_data, type_document, invoice.company_id.webpos_xml_engine)
+            stored_xml = invoice.xml_data_id._get_xml_for_fingerprint(fingerprint)
+            if stored_xml:
+                _logger.info("Payload sin cambios para la factura %s, se reutiliza el XML almacenado", invoice.id)
+                return stored_xml, f'{type_document}_{invoice.l10n_latam_document_number}.xml', fingerprint
+
+            if invoice.company_id.webpos_xml_engine == 'local':
+                xml_content, xml_name = self.env['webpos.ecf.engine']._build_xml(invoice, invoice_data, type_document)
+                return xml_content, xml_name, fingerprint
+
             # Call the webpos_api generate_xml endpoint
             api_data = {
                 'invoice_data': invoice_data,
@@ -483,14 +554,9 @@ class AccountMove(models.Model):
             }
             
             _logger.info("Calling WebPOS API with type_document: %s", type_document)
-            _logger.info("API Request Data: %s", json.dumps(api_data, indent=2))
             
             response = self._call_webpos_api('/webpos_api/generate_xml', api_data)
             
-            # Log the full API response
-            _logger.info("WebPOS API Response:")
-            _logger.info(json.dumps(response, indent=2))
-            
             # Check for errors in the response
             if 'error' in response:
                 _logger.error("XML Generation API Error: %s", response['error'])
@@ -503,13 +569,13 @@ class AccountMove(models.Model):
             # Additional validation of XML content
             if not xml_content:
                 _logger.error("No XML content generated for invoice %s", invoice.id)
-                _logger.error("Full API Response: %s", json.dumps(response, indent=2))
+                _logger.error("Full API Response: %s", response)
                 raise UserError(_('No XML data was generated for the invoice. Please check the invoice details and API configuration.'))
             
             _logger.info("XML Generation Successful. XML Name: %s", xml_name)
             _logger.info("XML Content Length: %d characters", len(xml_content))
             
-            return xml_content, xml_name
+            return xml_content, xml_name, fingerprint
             
         except Exception as e:
             # Comprehensive error logging
@@ -529,6 +595,111 @@ class AccountMove(models.Model):
                 'Please check invoice details, API configuration, and system logs.'
             ) % (invoice.id, type(e).__name__, str(e)))
     
+    def _build_xml_single(self):
+        """Generate the XML of each invoice with one generate_xml call per invoice.
+
+        Same result format as :meth:`_build_xml_batch`; errors are captured
+        per invoice instead of raised.
+        """
+        results = {}
+        for invoice in self:
+            try:
+                xml_content, xml_name, fingerprint = invoice._build_xml_with_fingerprint(
+                    invoice, invoice.doc_type_E(invoice))
+                results[invoice.id] = {'xml_content': xml_content, 'xml_name': xml_name, 'fingerprint': fingerprint}
+            except UserError as e:
+                results[invoice.id] = {'error': str(e)}
+        return results
+
+    def _build_xml_batch(self):
+        """Generate the XML of many invoices through /webpos_api/generate_xml_batch.
+
+        The payloads are sent in chunks of ``webpos_api.generate_batch_size``
+        documents; each document carries the invoice id as ``key`` so the
+        XMLs coming back can be mapped to their invoice. When the batch
+        endpoint is unavailable the chunk falls back to one call per invoice.
+        Invoices whose payload fingerprint matches the stored XML are not sent,
+        nor are those of companies using the local XML engine. The fingerprint
+        is returned, not stored: the caller writes it along with the XML.
+
+        :return: dict ``{invoice_id: {'xml_content', 'xml_name', 'fingerprint'} or {'error'}}``
+        """
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param('webpos_api.generate_batch_size', 50))
+        results = {}
+        for start in range(0, len(self), batch_size):
+            chunk = self[start:start + batch_size]
+            try:
+                invoice_data = chunk._prepare_invoice_data_batch()
+            except UserError:
+                # Se aisla la factura con datos invalidos
+                invoice_data = {}
+                for invoice in chunk:
+                    try:
+                        invoice_data.update(invoice._prepare_invoice_data_batch())
+                    except UserError as e:
+                        results[invoice.id] = {'error': str(e)}
+            documents = []
+            fingerprints = {}
+            for invoice in chunk.filtered(lambda inv: inv.id in invoice_data):
+                type_document = invoice.doc_type_E(invoice)
+                fingerprint = self.env['my.xml.data']._get_payload_fingerprint(
+                    invoice_data[invoice.id], type_document, invoice.company_id.webpos_xml_engine)
+                stored_xml = invoice.xml_data_id._get_xml_for_fingerprint(fingerprint)
+                if stored_xml:
+                    # Factura sin cambios desde la ultima generacion, no viaja a webpos_api
+                    results[invoice.id] = {
+                        'xml_content': stored_xml,
+                        'xml_name': f'{type_document}_{invoice.l10n_latam_document_number}.xml',
+                        'fingerprint': fingerprint,
+                    }
+                    continue
+                if invoice.company_id.webpos_xml_engine == 'local':
+                    try:
+                        xml_content, xml_name = self.env['webpos.ecf.engine']._build_xml(
+                            invoice, invoice_data[invoice.id], type_document)
+                    except UserError as e:
+                        results[invoice.id] = {'error': str(e)}
+                        continue
+                    results[invoice.id] = {'xml_content': xml_content, 'xml_name': xml_name, 'fingerprint': fingerprint}
+                    continue
+                fingerprints[invoice.id] = fingerprint
+                documents.append({
+                    'key': invoice.id,
+                    'invoice_data': invoice_data[invoice.id],
+                    'type_document': type_document,
+                })
+            if not documents:
+                continue
+
+            try:
+                response = self._call_webpos_api('/webpos_api/generate_xml_batch', {'documents': documents})
+                if 'error' in response:
+                    raise UserError(_('XML Generation Error: %s') % response['error'])
+            except UserError as e:
+                _logger.warning("Generacion XML por lote no disponible, se genera una por una: %s", str(e))
+                pending = chunk.browse([document['key'] for document in documents])
+                results.update(pending._build_xml_single())
+                continue
+
+            returned = {
+                document.get('key'): document
+                for document in (response.get('result') or {}).get('documents', [])
+            }
+            for document in documents:
+                invoice = chunk.browse(document['key'])
+                data = returned.get(invoice.id) or {}
+                if data.get('xml_content'):
+                    results[invoice.id] = {
+                        'xml_content': data['xml_content'],
+                        'xml_name': data.get('xml_name') or f"{document['type_document']}_{invoice.l10n_latam_document_number}.xml",
+                        'fingerprint': fingerprints[invoice.id],
+                    }
+                else:
+                    results[invoice.id] = {
+                        'error': data.get('error') or _('No XML data was generated for the invoice %s.') % invoice.id,
+                    }
+        return results
+
     def xml_print_to_std(self, content):
         """Print XML content to standard output (logging)"""
         try:
@@ -556,61 +727,55 @@ class AccountMove(models.Model):
         """
         Determines the appropriate WebPOS API document type (FF, FC, D, C, etc.)
         based on the invoice's NCF or move type.
-        
+
         NOTE: This module is primarily designed to work with 'Serie E' electronic invoices (e-NCFs).
         While it handles other NCF types for mapping purposes, the main focus is on e-invoices.
         """
-        import re
-        doc_type = None
-
-        # 1. Prioritize NCF type from l10n_latam_document_number
-        if invoice.l10n_latam_document_number:
-            _logger.info(f"EX347 0 Latam Document {invoice.l10n_latam_document_number}")
-            # Try to match the full NCF type (e.g., 'E31', 'B02')
-            ncf_match = re.match(r'^(E\d{2}|B\d{2})', invoice.l10n_latam_document_number)
-            if ncf_match:
-                ncf_prefix = ncf_match.group(1)
-                _logger.info(f"EX347 1 Prefix ncf {ncf_prefix}")
-                doc_type = self._API_DOCUMENT_TYPE_MAP.get(ncf_prefix)
-                _logger.info(f"EX347 2 Prefix ncf mapped {ncf_prefix}")
-                if doc_type:
-                    _logger.info(f"Resolved document type from NCF prefix {ncf_prefix}: {doc_type}")
-                    return doc_type
-
-            # Fallback for short alphanumeric codes if they appear at the beginning of the number
-            short_code_match = re.match(r'^(FF|FC|D|C|P|E|FE|FG|FX|PY)', invoice.l10n_latam_document_number)
-            if short_code_match:
-                short_code = short_code_match.group(1)
-                doc_type = self._API_DOCUMENT_TYPE_MAP.get(short_code)
-                if doc_type:
-                    _logger.info(f"Resolved document type from short NCF code {short_code}: {doc_type}")
-                    return doc_type
-            
-            # Fallback for numeric codes if they appear at the beginning of the number
-            numeric_code_match = re.match(r'^(\d{2})', invoice.l10n_latam_document_number)
-            if numeric_code_match:
-                numeric_code = numeric_code_match.group(1)
-                doc_type = self._API_DOCUMENT_TYPE_MAP.get(numeric_code)
-                if doc_type:
-                    _logger.info(f"Resolved document type from numeric code {numeric_code}: {doc_type}")
-                    return doc_type
-
-        # 2. Fallback to move_type and debit/credit note origin
-        if invoice.move_type:
-            # Custom logic for debit notes (out_invoice with debit_origin_id)
-            if invoice.move_type == 'out_invoice' and invoice.debit_origin_id:
-                doc_type = self._API_DOCUMENT_TYPE_MAP.get('out_debit')
-            else:
-                doc_type = self._API_DOCUMENT_TYPE_MAP.get(invoice.move_type)
-
+        is_debit = bool(invoice.debit_origin_id)
+        if invoice.l10n_latam_document_type_id:
+            doc_type = self._get_api_document_type(invoice.l10n_latam_document_type_id.id)
             if doc_type:
-                _logger.info(f"Resolved document type from move_type {invoice.move_type}: {doc_type}")
                 return doc_type
+        return self._resolve_api_document_type(invoice.l10n_latam_document_number, invoice.move_type, is_debit)
 
-        # 3. Default if no specific type is found
-        _logger.warning(f"Could not determine specific document type for invoice {invoice.id} (NCF: {invoice.l10n_latam_document_number}, Name: {invoice.name}, Move Type: {invoice.move_type}). Defaulting to FF.")
+    @api.model
+    def _match_api_document_type(self, value):
+        """WebPOS API document type of the prefix of ``value`` (NCF, prefix or code), or ``None``."""
+        for pattern in _NCF_PREFIX_PATTERNS:
+            match = pattern.match(value or '')
+            if match and match.group(1) in self._API_DOCUMENT_TYPE_MAP:
+                return self._API_DOCUMENT_TYPE_MAP[match.group(1)]
+        return None
+
+    @api.model
+    def _resolve_api_document_type(self, number, move_type=False, is_debit=False):
+        """WebPOS API document type from the NCF ``number``, falling back to the move type."""
+        doc_type = self._match_api_document_type(number)
+        if doc_type:
+            return doc_type
+        if move_type == 'out_invoice' and is_debit:
+            move_type = 'out_debit'
+        doc_type = self._API_DOCUMENT_TYPE_MAP.get(move_type)
+        if doc_type:
+            return doc_type
+        _logger.warning("Could not determine specific document type (NCF: %s, Move Type: %s). Defaulting to FF.",
+                        number, move_type)
         return 'FF' # Default to Fiscal Invoice (FF) if nothing else matches
 
+    @api.model
+    @tools.ormcache('document_type_id')
+    def _get_api_document_type(self, document_type_id):
+        """Memoized document type of a ``l10n_latam.document.type``.
+
+        The NCF number starts with the prefix of its document type, so the
+        prefix (or the code) resolves the type for every invoice sharing it.
+        Returns ``None`` when neither matches, so the caller falls back to
+        the number itself.
+        """
+        document_type = self.env['l10n_latam.document.type'].sudo().browse(document_type_id)
+        return (self._match_api_document_type(document_type.doc_code_prefix)
+                or self._match_api_document_type(document_type.code))
+
     # funciones heredadas de xml_data_id
     def action_resend_xml(self):
         self.xml_data_id.action_resend_xml()
@@ -619,13 +784,11 @@ class AccountMove(models.Model):
         # Verifica si existe un registro de my.xml.data asociado
         if not self.xml_data_id:
             # Si no existe, crea un nuevo registro en my.xml.data
-            # Determine document type based on current invoice characteristics
-            doc_type = self.doc_type_E(self) # Pass the invoice object
-            _logger_.info("EX444 0 doctype rebuild {doc_type}")
-            xml_content, xml_name = self.build_xml_to_print(self, doc_type)  # Genera el contenido XML
+            # El XML lo genera rebuild_xml_to_send de my.xml.data, una sola vez
             xml_data = self.env['my.xml.data'].create({
                 'name': self.l10n_latam_document_number,  # O el campo que desees usar
-                'xml_data': xml_content,
+                'xml_data': False,
+                'company_id': self.company_id.id,
                 'account_move_id': self.id,  # Asocia el XML con la factura
                 'status': 'pending',  # Establece el estado inicial
             })
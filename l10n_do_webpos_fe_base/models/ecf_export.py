@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import threading
+import zipfile
+from datetime import timedelta
+
+import requests
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+class EcfExport(models.Model):
+    """ZIP export of e-CF documents, built in the background by ir.cron.
+
+    Each cron run appends one batch of ``webpos_api.export_batch_size``
+    documents to the ZIP file and triggers itself again until the domain is
+    exhausted, so neither the HTTP worker nor a single cron run has to hold
+    the whole export. The finished file is served as is by
+    ``/webpos_fe/export/<id>/download``.
+    """
+    _name = 'webpos.ecf.export'
+    _description = 'Exportación ZIP de documentos electrónicos'
+    _order = 'id desc'
+
+    # payload -> (campo de my.xml.data, carpeta y extension dentro del ZIP)
+    _EXPORT_PAYLOADS = {
+        'xml': ('xml_data', 'xml/', '.xml'),
+        'xml_ecf': ('xml', 'xml_ecf/', '.xml'),
+        'pdf': ('pdf', 'pdf/', '.pdf'),
+    }
+
+    name = fields.Char(string='Archivo', required=True, readonly=True)
+    user_id = fields.Many2one('res.users', string='Usuario', required=True, readonly=True, index=True,
+                              default=lambda self: self.env.user)
+    company_id = fields.Many2one('res.company', string='Company', required=True, readonly=True,
+                                 default=lambda self: self.env.company)
+    res_model = fields.Selection([
+        ('my.xml.data', 'Documentos XML'),
+        ('account.move', 'Facturas'),
+    ], string='Modelo', required=True, default='my.xml.data', readonly=True)
+    domain = fields.Char(string='Dominio', required=True, default='[]', readonly=True)
+    payloads = fields.Char(string='Archivos', required=True, default='xml,pdf', readonly=True)
+    state = fields.Selection([
+        ('pending', 'En cola'),
+        ('running', 'En proceso'),
+        ('done', 'Listo'),
+        ('error', 'Error'),
+    ], string='Estado', default='pending', required=True, readonly=True, index=True)
+    # Progreso: ultimo my.xml.data agregado al ZIP
+    last_document_id = fields.Integer(string='Último documento', readonly=True)
+    document_count = fields.Integer(string='Documentos', readonly=True)
+    # Float: un ZIP con PDF de cientos de miles de documentos supera el limite de int4 (2 GB)
+    file_size = fields.Float(string='Tamaño (bytes)', digits=(16, 0), readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    date_done = fields.Datetime(string='Terminado', readonly=True)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        exports = super().create(vals_list)
+        self.env.ref('l10n_do_webpos_fe_base.ir_cron_webpos_ecf_export')._trigger()
+        return exports
+
+    def unlink(self):
+        paths = [export._get_file_path() for export in self]
+        res = super().unlink()
+
+        def remove_files():
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.env.cr.postcommit.add(remove_files)
+        return res
+
+    def _get_file_path(self):
+        self.ensure_one()
+        return os.path.join(tools.config.filestore(self.env.cr.dbname), 'webpos_ecf_export', f'{self.id}.zip')
+
+    def _get_document_domain(self):
+        self.ensure_one()
+        domain = json.loads(self.domain)
+        if self.res_model == 'account.move':
+            domain = [('account_move_id', 'any', domain)]
+        return domain
+
+    def _export_batch(self, batch_size):
+        """Append the next ``batch_size`` documents to the ZIP; return whether the export is complete."""
+        self.ensure_one()
+        # La busqueda se hace con el usuario de la exportacion, respetando permisos y reglas de registro
+        documents = self.env['my.xml.data'].with_user(self.user_id).with_context(
+            allowed_company_ids=self.user_id.company_ids.ids,
+        ).search(self._get_document_domain() + [('id', '>', self.last_document_id)], order='id', limit=batch_size)
+        documents = documents.sudo()
+        payloads = [payload for payload in self.payloads.split(',') if payload in self._EXPORT_PAYLOADS]
+
+        path = self._get_file_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        mode = 'a' if self.last_document_id and os.path.exists(path) else 'w'
+        client = self.env['webpos.api.client']
+        with zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED) as archive:
+            used_names = set(archive.namelist())
+            files = documents._get_payload_files([self._EXPORT_PAYLOADS[payload][0] for payload in payloads])
+            for document in documents:
+                for payload in payloads:
+                    fname, folder, extension = self._EXPORT_PAYLOADS[payload]
+                    content = files.get((document.id, fname))
+                    if not content and fname == 'pdf' and document.status == 'procesed' \
+                            and not client._is_circuit_open():
+                        # Fuera de la cache: una exportacion masiva no debe desalojar los PDF en uso
+                        try:
+                            content = document._fetch_pdf()
+                        except (UserError, requests.exceptions.RequestException) as e:
+                            _logger.warning('PDF no exportado para %s: %s', document.name, str(e))
+                    if not content:
+                        continue
+                    entry_name = f'{folder}{document.name or document.id}{extension}'
+                    if entry_name in used_names:
+                        entry_name = f'{folder}{document.name or document.id}_{document.id}{extension}'
+                    used_names.add(entry_name)
+                    archive.writestr(entry_name, content)
+
+        vals = {'state': 'running', 'document_count': self.document_count + len(documents)}
+        if documents:
+            vals['last_document_id'] = documents[-1].id
+        done = len(documents) < batch_size
+        if done:
+            vals.update(state='done', date_done=fields.Datetime.now(), file_size=os.path.getsize(path))
+        self.write(vals)
+        return done
+
+    @api.model
+    def _cron_process_exports(self):
+        """Advance the oldest pending export by one batch. Called from ir.cron.
+
+        Re-triggers the cron while exports remain, and removes the finished
+        ones older than ``webpos_api.export_retention_days`` days.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        batch_size = int(ICP.get_param('webpos_api.export_batch_size', 500))
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        export = self.search([('state', 'in', ('pending', 'running'))], order='id', limit=1)
+        if export:
+            try:
+                with self.env.cr.savepoint():
+                    export._export_batch(batch_size)
+            except Exception as e:
+                _logger.exception('Error generando la exportacion ZIP %s', export.name)
+                export.write({'state': 'error', 'error': str(e)})
+            if auto_commit:
+                self.env.cr.commit()
+            if self.search_count([('state', 'in', ('pending', 'running'))], limit=1):
+                self.env.ref('l10n_do_webpos_fe_base.ir_cron_webpos_ecf_export')._trigger()
+
+        retention_days = int(ICP.get_param('webpos_api.export_retention_days', 7))
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        self.search([('state', 'in', ('done', 'error')), ('create_date', '<', cutoff)]).unlink()
+
+    def action_download(self):
+        self.ensure_one()
+        if self.state != 'done':
+            raise UserError(_('La exportación aún no está lista.'))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/webpos_fe/export/{self.id}/download',
+            'target': 'self',
+        }
@@ -0,0 +1,46 @@
+import json
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+
+
+class EcfExportWizard(models.TransientModel):
+    _name = 'webpos.ecf.export.wizard'
+    _description = 'Exportar XML y PDF de documentos electrónicos'
+
+    date_from = fields.Date(string='Desde', required=True)
+    date_to = fields.Date(string='Hasta', required=True)
+    company_id = fields.Many2one('res.company', string='Company', required=True, default=lambda self: self.env.company)
+    include_xml = fields.Boolean(string='XML enviado', default=True)
+    include_xml_ecf = fields.Boolean(string='XML ECF (DGII)')
+    include_pdf = fields.Boolean(string='PDF', default=True)
+
+    def action_export(self):
+        """Queue a webpos.ecf.export of the selected invoices and open it."""
+        self.ensure_one()
+        payloads = [
+            payload for payload, include in (
+                ('xml', self.include_xml), ('xml_ecf', self.include_xml_ecf), ('pdf', self.include_pdf))
+            if include
+        ]
+        if not payloads:
+            raise UserError(_('Seleccione al menos un tipo de archivo a exportar.'))
+        domain = [
+            ('company_id', '=', self.company_id.id),
+            ('invoice_date', '>=', fields.Date.to_string(self.date_from)),
+            ('invoice_date', '<=', fields.Date.to_string(self.date_to)),
+        ]
+        export = self.env['webpos.ecf.export'].create({
+            'name': f'ecf_{self.date_from}_{self.date_to}.zip',
+            'company_id': self.company_id.id,
+            'res_model': 'account.move',
+            'domain': json.dumps(domain),
+            'payloads': ','.join(payloads),
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'webpos.ecf.export',
+            'res_id': export.id,
+            'view_mode': 'form',
+            'name': _('Exportación ZIP'),
+        }
@@ -0,0 +1,291 @@
+import logging
+
+from lxml import etree
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+def _amount(value):
+    return "{:.2f}".format(abs(round(value, 2)))
+
+
+def _unit_price(value):
+    """Unit price with 2 to 4 decimals, the fewest that keep its precision (DGII)."""
+    for digits in (2, 3):
+        if round(value, digits) == round(value, 4):
+            return "{:.{}f}".format(round(value, digits), digits)
+    return "{:.4f}".format(round(value, 4))
+
+
+def _dgii_date(value):
+    return fields.Date.to_date(value).strftime("%d-%m-%Y") if value else False
+
+
+class WebposEcfEngine(models.AbstractModel):
+    """Local e-CF XML builder, an alternative to /webpos_api/generate_xml.
+
+    Follows the DGII structure of models/analizar_aqui.py (IdDoc, Emisor,
+    Comprador, Totales, DetallesItems, InformacionReferencia) but works from
+    the payload of ``AccountMove._prepare_invoice_data_batch``, so both
+    engines start from the very same data. The XML is left unsigned, as the
+    one returned by webpos_api: signing happens on send, and the signer fills
+    the ``FechaHoraFirma`` placeholder.
+
+    :meth:`_build_xml` only reads from the database what the payload lacks
+    (:meth:`_get_document_context`); :meth:`_build_xml_from_data` is
+    deterministic, which the engine tests (tests/test_ecf_engine.py) rely on.
+    """
+    _name = 'webpos.ecf.engine'
+    _description = 'Generador local de XML e-CF'
+
+    _ITBIS_RATES = {18.0: 1, 16.0: 2}
+
+    @api.model
+    def _build_xml(self, invoice, invoice_data, type_document, sign_time=None):
+        """Return ``(xml_content, xml_name)`` of the e-CF of ``invoice``."""
+        return self._build_xml_from_data(invoice_data, self._get_document_context(invoice), type_document, sign_time)
+
+    @api.model
+    def _get_document_context(self, invoice):
+        """What the e-CF needs besides the webpos_api payload, as plain values."""
+        company = invoice.company_id
+        origin = invoice.reversed_entry_id or invoice.debit_origin_id
+        return {
+            'company': {
+                'vat': company.vat or '',
+                'name': company.name or '',
+                'street': company.street or '',
+                'email': company.email or '',
+                'website': company.website or '',
+                'currency': company.currency_id.name,
+            },
+            'income_type': invoice['l10n_do_income_type'] if 'l10n_do_income_type' in invoice._fields else False,
+            'modification_code': invoice['l10n_do_ecf_modification_code']
+            if 'l10n_do_ecf_modification_code' in invoice._fields else False,
+            'origin': {
+                'number': origin.l10n_latam_document_number or '',
+                'date': fields.Date.to_string(origin.invoice_date) or '',
+            } if origin else False,
+        }
+
+    @api.model
+    def _build_xml_from_data(self, invoice_data, context, type_document, sign_time=None):
+        """Build the e-CF from the payload and :meth:`_get_document_context` values.
+
+        ``sign_time`` fills ``FechaHoraFirma``; without it the element is left
+        empty for the signer, so the same input always gives the same XML.
+        """
+        record = invoice_data['record']
+        number = record['l10n_latam_document_number']
+        if not number or not number.startswith('E'):
+            raise UserError(_('El generador local solo emite e-CF (serie E), documento: %s') % (number or '-'))
+        ncf_type = number[1:3]
+
+        rate = 1.0
+        currency = record['currency_id'] or {}
+        foreign_currency = currency.get('name') and currency['name'] != context['company']['currency']
+        if foreign_currency:
+            rate = currency.get('inverse_rate') or 1.0
+
+        items, totals = self._get_items_and_totals(invoice_data, ncf_type, rate)
+        header = {
+            'Version': '1.0',
+            'IdDoc': self._get_id_doc(context, record, ncf_type, totals),
+            'Emisor': self._get_emisor(context, record),
+            'Comprador': self._get_comprador(record, ncf_type) if ncf_type not in ('43', '47') else None,
+            'Totales': self._get_totales(record, ncf_type, totals, rate),
+        }
+        if foreign_currency:
+            header['OtraMoneda'] = {
+                'TipoMoneda': currency['name'],
+                'TipoCambio': "{:.4f}".format(rate),
+                'MontoTotalOtraMoneda': _amount(totals['total'] / rate),
+            }
+        ecf = {
+            'Encabezado': header,
+            'DetallesItems': {'Item': items},
+        }
+        if ncf_type in ('33', '34'):
+            ecf['InformacionReferencia'] = self._get_informacion_referencia(context)
+        ecf['FechaHoraFirma'] = sign_time.strftime("%d-%m-%Y %H:%M:%S") if sign_time else ''
+
+        root = etree.Element('ECF')
+        self._append_elements(root, ecf)
+        xml_content = etree.tostring(root, encoding='utf-8', xml_declaration=True).decode('utf-8')
+        return xml_content, f'{type_document}_{number}.xml'
+
+    @api.model
+    def _append_elements(self, parent, values):
+        """Append ``values`` (dicts keep the DGII order) below ``parent``; empty values are skipped."""
+        for tag, value in values.items():
+            if value is None or value is False or value == {}:
+                continue
+            if isinstance(value, list):
+                for item in value:
+                    self._append_elements(etree.SubElement(parent, tag), item)
+            elif isinstance(value, dict):
+                self._append_elements(etree.SubElement(parent, tag), value)
+            else:
+                etree.SubElement(parent, tag).text = str(value)
+
+    @api.model
+    def _get_items_and_totals(self, invoice_data, ncf_type, rate):
+        """DetallesItems and the amounts per ITBIS rate, in company currency."""
+        totals = {
+            'base': {1: 0.0, 2: 0.0, 3: 0.0},
+            'itbis': {1: 0.0, 2: 0.0, 3: 0.0},
+            'exempt': 0.0,
+            'itbis_withholding': 0.0,
+            'isr_withholding': 0.0,
+            'tax_included': False,
+        }
+        items = []
+        for sequence, line in enumerate(invoice_data['lines'], 1):
+            taxes = line['tax_ids']
+            base = (line['price_subtotal'] or 0.0) * rate
+            indicator = 4
+            itbis = 0.0
+            for tax in taxes:
+                if tax['amount'] < 0:
+                    key = 'isr_withholding' if 'ISR' in (tax['name'] or '').upper() else 'itbis_withholding'
+                    totals[key] += base * -tax['amount'] / 100
+                elif tax['amount'] in self._ITBIS_RATES:
+                    indicator = min(indicator, self._ITBIS_RATES[tax['amount']])
+                    itbis += base * tax['amount'] / 100
+                    totals['tax_included'] |= bool(tax['price_include'])
+                elif ncf_type == '46':
+                    indicator = min(indicator, 3)
+            if indicator == 4:
+                totals['exempt'] += base
+            else:
+                totals['base'][indicator] += base
+                totals['itbis'][indicator] += itbis
+
+            quantity = line['quantity'] or 1.0
+            gross = (line['price_unit'] or 0.0) * quantity * rate
+            discount = round(gross - base, 2) if line['discount'] else 0.0
+            name = (line['product_id'] or {}).get('name') or line['name'] or ''
+            item = {
+                'NumeroLinea': sequence,
+                'IndicadorFacturacion': indicator,
+                'NombreItem': (name[:78] + '..') if len(name) > 78 else name,
+                'IndicadorBienoServicio': '2' if ncf_type == '47' else '1',
+                'CantidadItem': "{:.2f}".format(quantity),
+                'PrecioUnitarioItem': _unit_price(abs((base + discount) / quantity)),
+            }
+            if discount:
+                item['DescuentoMonto'] = _amount(discount)
+                item['TablaSubDescuento'] = {'SubDescuento': {
+                    'TipoSubDescuento': '$',
+                    'MontoSubDescuento': _amount(discount),
+                }}
+            if rate != 1.0:
+                item['OtraMonedaDetalle'] = {
+                    'PrecioOtraMoneda': _unit_price(abs(line['price_unit'] or 0.0)),
+                    'DescuentoOtraMoneda': _amount(discount / rate),
+                    'MontoItemOtraMoneda': _amount(line['price_subtotal'] or 0.0),
+                }
+            item['MontoItem'] = _amount(base)
+            items.append(item)
+
+        record = invoice_data['record']
+        totals['itbis_withholding'] += (record.get('withholded_itbis') or 0.0) * rate
+        totals['isr_withholding'] += (record.get('income_withholding') or 0.0) * rate
+        totals['total'] = sum(totals['base'].values()) + sum(totals['itbis'].values()) + totals['exempt']
+        return items, totals
+
+    @api.model
+    def _get_id_doc(self, context, record, ncf_type, totals):
+        id_doc = {
+            'TipoeCF': ncf_type,
+            'eNCF': record['l10n_latam_document_number'],
+        }
+        if ncf_type not in ('32', '34'):
+            if not record['ncf_expiration_date']:
+                raise UserError(_("No puede confirmar una factura tipo %s sin antes asignar la fecha de vencimiento.") % ncf_type)
+            id_doc['FechaVencimientoSecuencia'] = _dgii_date(record['ncf_expiration_date'])
+        if ncf_type == '34':
+            invoice_date = fields.Date.to_date(record['invoice_date'])
+            origin_date = fields.Date.to_date((context['origin'] or {}).get('date')) or invoice_date
+            id_doc['IndicadorNotaCredito'] = int(abs((invoice_date - origin_date).days) > 30) if invoice_date else 0
+        if ncf_type not in ('43', '44', '46', '47'):
+            id_doc['IndicadorMontoGravado'] = int(totals['tax_included'])
+        if ncf_type not in ('41', '43', '47'):
+            id_doc['TipoIngresos'] = context['income_type'] or '01'
+        # 1: contado, 2: credito
+        id_doc['TipoPago'] = 1 if record['payment_ids'] or record['invoice_payments_widget'] else 2
+        return id_doc
+
+    @api.model
+    def _get_emisor(self, context, record):
+        company = context['company']
+        if not company['street'].strip():
+            raise UserError(_("Cannot send an ECF if company has no address."))
+        return {
+            'RNCEmisor': company['vat'].replace('-', ''),
+            'RazonSocialEmisor': company['name'],
+            'NombreComercial': company['name'],
+            'DireccionEmisor': company['street'],
+            'CorreoEmisor': company['email'] or False,
+            'WebSite': company['website'].replace('http://', '') or False,
+            'FechaEmision': _dgii_date(record['invoice_date']),
+        }
+
+    @api.model
+    def _get_comprador(self, record, ncf_type):
+        partner = record['partner_id'] or {}
+        vat = (partner.get('vat') or '').replace('-', '')
+        buyer = {}
+        if vat and (ncf_type != '46' or partner.get('country_name') in ('', 'Dominican Republic', 'República Dominicana')):
+            buyer['RNCComprador'] = vat
+        elif vat:
+            buyer['IdentificadorExtranjero'] = vat
+        if ncf_type != '32' or vat:
+            buyer['RazonSocialComprador'] = partner.get('name') or False
+        buyer['CorreoComprador'] = partner.get('email') or False
+        buyer['DireccionComprador'] = partner.get('street') or False
+        # Consumidor final sin datos: sin nodo Comprador vacio
+        return {tag: value for tag, value in buyer.items() if value}
+
+    @api.model
+    def _get_totales(self, record, ncf_type, totals, rate):
+        base, itbis = totals['base'], totals['itbis']
+        total_taxed = sum(base.values())
+        total_itbis = sum(itbis.values())
+        if ncf_type in ('43', '44', '47') and total_itbis:
+            raise UserError(_("No puede confirmar una factura de regimen especial, gasto menor o extranjero "
+                              "cuando las mismas contiene ITBIS."))
+        data = {}
+        if total_taxed:
+            data['MontoGravadoTotal'] = _amount(total_taxed)
+            for indicator in (1, 2, 3):
+                data[f'MontoGravadoI{indicator}'] = _amount(base[indicator]) if base[indicator] else False
+        if totals['exempt']:
+            data['MontoExento'] = _amount(totals['exempt'])
+        if total_taxed:
+            for indicator, percent in ((1, '18'), (2, '16'), (3, '0')):
+                data[f'ITBIS{indicator}'] = percent if base[indicator] else False
+            data['TotalITBIS'] = _amount(total_itbis)
+            for indicator in (1, 2, 3):
+                data[f'TotalITBIS{indicator}'] = _amount(itbis[indicator]) if base[indicator] else False
+        data['MontoTotal'] = _amount(totals['total'])
+        if ncf_type not in ('43', '44'):
+            if totals['itbis_withholding'] or ncf_type == '41':
+                data['TotalITBISRetenido'] = _amount(totals['itbis_withholding'])
+            if totals['isr_withholding'] or ncf_type in ('41', '47'):
+                data['TotalISRRetencion'] = _amount(totals['isr_withholding'])
+        return data
+
+    @api.model
+    def _get_informacion_referencia(self, context):
+        origin = context['origin']
+        if not origin:
+            raise UserError(_("Could not found origin document."))
+        return {
+            'NCFModificado': origin['number'],
+            'FechaNCFModificado': _dgii_date(origin['date']),
+            'CodigoModificacion': context['modification_code'],
+        }
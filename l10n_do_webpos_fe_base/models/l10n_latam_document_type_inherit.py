@@ -0,0 +1,15 @@
+from odoo import models
+
+
+class L10nLatamDocumentType(models.Model):
+    _inherit = 'l10n_latam.document.type'
+
+    # Campos de los que AccountMove._get_api_document_type deduce el tipo WebPOS
+    _WEBPOS_TYPE_FIELDS = {'doc_code_prefix', 'code'}
+
+    def write(self, vals):
+        res = super().write(vals)
+        if self._WEBPOS_TYPE_FIELDS.intersection(vals):
+            # El tipo WebPOS queda en ormcache: se invalida en todos los workers
+            self.env.registry.clear_cache()
+        return res
@@ -1,14 +1,45 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import UserError, ValidationError
 import requests
 import logging
 import base64
+import gzip
+import hashlib
 import json
-from datetime import datetime, date
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import psycopg2
+
+from .webpos_api_client import _canonical_json
 #from odoo.addons.l10n_do_webpos_fe_base.utils.xml_base import XmlInterface
 
 _logger = logging.getLogger(__name__)
 
+
+def _compress_payload(text):
+    """gzip a text payload for its filestore attachment (base64, as Binary fields expect).
+
+    ``mtime=0`` keeps the output deterministic, so identical payloads share
+    the same checksum and therefore the same file in the filestore.
+    """
+    if not text:
+        return False
+    return base64.b64encode(gzip.compress(text.encode('utf-8'), mtime=0))
+
+
+def _hash_payload(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest() if text else False
+
+
+def _decompress_payload(blob):
+    if not blob:
+        return False
+    return gzip.decompress(base64.b64decode(blob)).decode('utf-8')
+
+
 class MyXMLData(models.Model):
     _name = 'my.xml.data'
     _description = 'Maneja el procesamiento de documento XML '
@@ -17,26 +48,103 @@ class MyXMLData(models.Model):
     _prefijo_nota_credito = 'C'
     _prefijo_nota_debito = 'D'
     _prefijo_no_fiscal = 'N'
+
+    # Estados DGII (dgiStatus) a partir de los cuales ya no se vuelve a verificar
+    _DGI_FINAL_STATUSES = ('aceptado', 'aceptadocondicional', 'rechazado')
+
+    # Campo de my.xml.data -> clave de la respuesta de /webpos_api/verify_status
+    _VERIFY_RESPONSE_FIELDS = {
+        'cufe': 'cufe',
+        'doc_type': 'docType',
+        'doc_date': 'docDate',
+        'company_lic_cod': 'companyLicCod',
+        'company_ruc': 'companyRuc',
+        'branch_cod': 'branchCod',
+        'pos_cod': 'posCod',
+        'fe_number': 'feNumber',
+        'authorized': 'authorized',
+        'auth_number': 'authNumber',
+        'auth_date': 'authDate',
+        'xml': 'xml',
+        'date_rec': 'dateRec',
+        'system_ref': 'system_ref',
+        'doc_affected_ref': 'docAffectedRef',
+        'sub_doc_type': 'subDocType',
+        'qr_code': 'qrCode',
+        'qr_l1': 'qrL1',
+        'qr_l2': 'qrL2',
+        'xml_webpos': 'xmlWebPOS',
+        'sub_total': 'subTotal',
+        'tax_total': 'taxTotal',
+        'total': 'total',
+        'sbt0': 'sbt0',
+        'sbt1': 'sbt1',
+        'sbt2': 'sbt2',
+        'sbt3': 'sbt3',
+        'tax1': 'tax1',
+        'tax2': 'tax2',
+        'tax3': 'tax3',
+        'dgi_resp': 'dgiResp',
+        'dgi_err_msg': 'dgiErrMsg',
+        'sts': 'sts',
+        'dgi_sts': 'dgiSts',
+        'dgi_status': 'dgiStatus',
+    }
+
+    # Estados en los que un XML reconstruido vuelve a la cola de envio
+    _REQUEUE_STATUSES = ('pending', 'error', 'contingency')
+
+    # Campos de texto pesados -> adjunto comprimido en el filestore que los respalda
+    _PAYLOAD_FIELDS = {
+        'xml_data': 'xml_data_file',
+        'xml': 'xml_file',
+        'xml_webpos': 'xml_webpos_file',
+        'json_response': 'json_response_file',
+        'json_response_sent': 'json_response_sent_file',
+    }
     
-    name = fields.Char(string='Name')
-    xml_data = fields.Text(string='XML Data', default="<xml> probando</xml>")
+    name = fields.Char(string='Name', index=True)
+    xml_data = fields.Text(string='XML Data', compute='_compute_xml_data', inverse='_inverse_xml_data')
     status = fields.Selection([
         ('pending', 'Por enviar'),
         ('sent', 'Enviado'),
         ('error', 'Error'),
+        ('contingency', 'Contingencia'),
         ('procesed', 'Procesado')
-    ], default='pending', string='Status')
+    ], default='pending', string='Status', index=True)
     state = fields.Selection([('to_send', 'To Send'), ('sent', 'Sent'), ('to_cancel', 'To Cancel'), ('cancelled', 'Cancelled')])
     error = fields.Text(string='Error Message')
-    company_id = fields.Many2one('res.company', string='Company', required=True, default=lambda self: self.env.company)
-    account_move_id = fields.Many2one('account.move', string='Cuenta de Movimiento')
+    company_id = fields.Many2one('res.company', string='Company', required=True, index=True, default=lambda self: self.env.company)
+    account_move_id = fields.Many2one('account.move', string='Cuenta de Movimiento', index=True)
     l10n_do_ncf_type = fields.Char(string='l10n_do_ncf_type')
+    queue_attempts = fields.Integer(string='Intentos de envío', default=0, copy=False)
+    queue_last_date = fields.Datetime(string='Último intento', copy=False)
+    idempotency_key = fields.Char(string='Clave de idempotencia', copy=False, readonly=True,
+                                  help='Clave del último envío aceptado por webpos_api.')
+    verify_attempts = fields.Integer(string='Verificaciones', default=0, copy=False)
+    next_verify_date = fields.Datetime(string='Próxima verificación', copy=False)
+    xml_hash = fields.Char(string='Hash XML', copy=False, readonly=True,
+                           help='sha256 del XML actual, permite detectar reconstrucciones sin cambios.')
+    payload_fingerprint = fields.Char(string='Huella del payload', copy=False, readonly=True,
+                                      help='sha256 del payload de la factura con el que se generó el XML actual.')
+    version_ids = fields.One2many('my.xml.data.version', 'document_id', string='Versiones anteriores', readonly=True)
+    event_ids = fields.One2many('my.xml.data.event', 'document_id', string='Historial', readonly=True)
+    # Documento archivado: la fila se conserva (estado, historial, versiones) y sus payloads
+    # viven comprimidos en el archivo, ver my.xml.data.archive
+    archive_id = fields.Many2one('my.xml.data.archive', string='Archivo', readonly=True, copy=False,
+                                 index=True, ondelete='set null')
  
     # Field for binary download
     xml_file_binary = fields.Binary(string="XML File", compute='_compute_xml_file_binary', store=False)
 
-    @api.depends('xml_data')
+    @api.depends('xml_data_file')
+    @api.depends_context('bin_size')
     def _compute_xml_file_binary(self):
+        if self.env.context.get('bin_size'):
+            # Vistas de lista: basta el tamaño del adjunto, sin descomprimir ni codificar el XML
+            for record in self:
+                record.xml_file_binary = record.with_context(bin_size=True).xml_data_file
+            return
         for record in self:
             if record.xml_data:
                 record.xml_file_binary = base64.b64encode(record.xml_data.encode('utf-8'))
@@ -44,9 +152,9 @@ class MyXMLData(models.Model):
                 record.xml_file_binary = False
 
     # Campos de webpos.document response api
-    cufe = fields.Char(string='CUFE', default='NOT SET')
+    cufe = fields.Char(string='CUFE', default='NOT SET', index=True)
     doc_type = fields.Char(string='Tipo de Documento', default='NOT SET')
-    doc_date = fields.Date(string='Fecha de Documento')
+    doc_date = fields.Date(string='Fecha de Documento', index=True)
     company_lic_cod = fields.Char(string='Código de Licencia', default='NOT SET')
     company_ruc = fields.Char(string='RUC de la Empresa', default='NOT SET')
     branch_cod = fields.Char(string='Código de Sucursal', default='NOT SET')
@@ -55,8 +163,11 @@ class MyXMLData(models.Model):
     authorized = fields.Boolean(string='Autorizado')
     auth_number = fields.Char(string='Número de Autorización', default='NOT SET')
     auth_date = fields.Date(string='Fecha de Autorización')
-    xml = fields.Text(string="XML ECF")
-    pdf = fields.Binary(string='PDF Data')
+    xml = fields.Text(string="XML ECF", compute='_compute_xml', inverse='_inverse_xml')
+    # Cache del PDF: se descarga de webpos_api la primera vez que se abre (ver _ensure_pdf)
+    pdf = fields.Binary(string='PDF Data', attachment=True, copy=False)
+    pdf_size = fields.Integer(string='Tamaño PDF', copy=False)
+    pdf_cache_date = fields.Datetime(string='Último acceso PDF', copy=False)
     date_rec = fields.Date(string='Fecha de Recepción')
     system_ref = fields.Char(string='Referencia del Sistema', default='NOT SET')
     doc_affected_ref = fields.Char(string='Referencia del Documento Afectado', default='NOT SET')
@@ -65,7 +176,7 @@ class MyXMLData(models.Model):
     qr_code = fields.Char(string="QR Code")
     qr_l1 = fields.Char(string="Código de Seguridad")
     qr_l2 = fields.Char(string="Fecha Firma Digital")
-    xml_webpos = fields.Text(string="XML WebPOS")
+    xml_webpos = fields.Text(string="XML WebPOS", compute='_compute_xml_webpos', inverse='_inverse_xml_webpos')
     sub_total = fields.Float(string="Subtotal")
     tax_total = fields.Float(string="Total de ITBIS")
     total = fields.Float(string="Monto Total")
@@ -81,25 +192,116 @@ class MyXMLData(models.Model):
     sts = fields.Integer(string="Estado")
     dgi_sts = fields.Integer(string="Estado DGI")
     dgi_status = fields.Char(string="Estado DGI (Texto)", default="NO ENVIADO")
-    json_response_sent = fields.Text(string='Res JSON(envio)')
-    json_response = fields.Text(string='Res JSON(recibido)')
- 
-    def _serialize_datetime_data(self, data):
-        """
-        Recursively convert datetime objects to strings in nested data structures
-        to ensure JSON serialization compatibility.
+    json_response_sent = fields.Text(string='Res JSON(envio)', compute='_compute_json_response_sent',
+                                     inverse='_inverse_json_response_sent')
+    json_response = fields.Text(string='Res JSON(recibido)', compute='_compute_json_response',
+                                inverse='_inverse_json_response')
+
+    # Respaldo en el filestore (gzip) de los campos de _PAYLOAD_FIELDS
+    xml_data_file = fields.Binary(string='XML Data (archivo)', attachment=True, copy=False)
+    xml_file = fields.Binary(string='XML ECF (archivo)', attachment=True, copy=False)
+    xml_webpos_file = fields.Binary(string='XML WebPOS (archivo)', attachment=True, copy=False)
+    json_response_file = fields.Binary(string='Res JSON recibido (archivo)', attachment=True, copy=False)
+    json_response_sent_file = fields.Binary(string='Res JSON envio (archivo)', attachment=True, copy=False)
+
+    def init(self):
+        super().init()
+        # Indice parcial de la cola: solo los documentos aun no finalizados, de modo
+        # que los barridos de los crons no crecen con el historico procesado.
+        tools.create_index(
+            self.env.cr, 'my_xml_data_work_queue_index', self._table,
+            ['status', 'next_verify_date', 'id'],
+            where="status IN ('pending', 'sent', 'error', 'contingency')",
+        )
+
+    # Each payload has its own compute so reading one field only loads its own attachment.
+
+    def _read_payload(self, fname):
+        blobs = self.with_context(bin_size=False).mapped(self._PAYLOAD_FIELDS[fname])
+        for record, blob in zip(self, blobs):
+            if not blob and record.archive_id:
+                # Documento archivado: se lee desde el almacenamiento en frio
+                record[fname] = record.archive_id._get_payloads().get(fname) or False
+            else:
+                record[fname] = _decompress_payload(blob)
+
+    def _write_payload(self, fname):
+        blob_fname = self._PAYLOAD_FIELDS[fname]
+        for record in self:
+            record[blob_fname] = _compress_payload(record[fname])
+
+    def _has_payload(self, fname):
+        """Whether the payload is stored, without reading the attachment content."""
+        self.ensure_one()
+        if self.with_context(bin_size=True)[self._PAYLOAD_FIELDS[fname]]:
+            return True
+        return bool(self.archive_id and self.archive_id._get_payloads().get(fname))
+
+    def _get_payload_files(self, fnames):
+        """Raw bytes of the given payloads for all records, with one attachment query.
+
+        Text payloads are returned decompressed. Returns ``{(record_id, fname): bytes}``.
         """
-        if isinstance(data, (datetime, date)):
-            return data.strftime('%Y-%m-%d %H:%M:%S') if isinstance(data, datetime) else data.strftime('%Y-%m-%d')
-        elif isinstance(data, dict):
-            return {key: self._serialize_datetime_data(value) for key, value in data.items()}
-        elif isinstance(data, list):
-            return [self._serialize_datetime_data(item) for item in data]
-        elif isinstance(data, tuple):
-            return tuple(self._serialize_datetime_data(item) for item in data)
-        else:
-            return data
+        blob_fnames = {self._PAYLOAD_FIELDS.get(fname, fname): fname for fname in fnames}
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', self.ids),
+            ('res_field', 'in', list(blob_fnames)),
+        ])
+        files = {}
+        for attachment in attachments:
+            fname = blob_fnames[attachment.res_field]
+            content = attachment.raw
+            if fname in self._PAYLOAD_FIELDS and content:
+                content = gzip.decompress(content)
+            files[attachment.res_id, fname] = content
+        for record in self.filtered('archive_id'):
+            payloads = None
+            for fname in fnames:
+                if fname in self._PAYLOAD_FIELDS and (record.id, fname) not in files:
+                    if payloads is None:
+                        payloads = record.archive_id._get_payloads()
+                    if payloads.get(fname):
+                        files[record.id, fname] = payloads[fname].encode('utf-8')
+        return files
 
+    @api.depends('xml_data_file', 'archive_id')
+    def _compute_xml_data(self):
+        self._read_payload('xml_data')
+
+    def _inverse_xml_data(self):
+        self._write_payload('xml_data')
+        for record in self:
+            record.xml_hash = _hash_payload(record.xml_data)
+
+    @api.depends('xml_file', 'archive_id')
+    def _compute_xml(self):
+        self._read_payload('xml')
+
+    def _inverse_xml(self):
+        self._write_payload('xml')
+
+    @api.depends('xml_webpos_file', 'archive_id')
+    def _compute_xml_webpos(self):
+        self._read_payload('xml_webpos')
+
+    def _inverse_xml_webpos(self):
+        self._write_payload('xml_webpos')
+
+    @api.depends('json_response_file', 'archive_id')
+    def _compute_json_response(self):
+        self._read_payload('json_response')
+
+    def _inverse_json_response(self):
+        self._write_payload('json_response')
+
+    @api.depends('json_response_sent_file', 'archive_id')
+    def _compute_json_response_sent(self):
+        self._read_payload('json_response_sent')
+
+    def _inverse_json_response_sent(self):
+        self._write_payload('json_response_sent')
+ 
     # @api.model
     # def create(self, vals):
     #     try:
@@ -119,107 +321,133 @@ class MyXMLData(models.Model):
     
     
     
+    def _action_download_payload(self, payload, name):
+        """Download a payload through the streaming controller (controllers/main.py)."""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/webpos_fe/document/{self.id}/{payload}',
+            'target': 'new',
+            'name': name,
+        }
+
     def action_download_json(self):
         self.ensure_one()  # Asegúrate de que solo haya un registro
-        json_data = self.json_response
-        
-        if not json_data:
+        if not self._has_payload('json_response'):
             raise UserError("No hay datos JSON para descargar.")
+        return self._action_download_payload('json', 'Descargar JSON')
 
-        # Convertir el texto JSON a bytes
-        json_bytes = json_data.encode('utf-8')
-        
-        # Crear el archivo base64 para la descarga
-        json_base64 = base64.b64encode(json_bytes).decode('utf-8')
+    def action_download_pdf(self):
+        self.ensure_one()
+        return self._action_download_payload('pdf', 'Descargar PDF')
 
-        return {
-            'type': 'ir.actions.act_url',
-            'url': 'data:application/json;base64,' + json_base64,
-            'target': 'new',
-            'name': 'Descargar JSON',
-        }
+    def action_download_xml(self):
+        self.ensure_one()
+        if not self._has_payload('xml_data'):
+            raise UserError(_('No hay datos XML para descargar.'))
+        return self._action_download_payload('xml', 'Descargar XML')
 
 
-    def save_and_send_xml(self):
-        ''' 
-        Refactored: Calls the webpos_api endpoint to send XML and updates the record with the response.
-        '''
-        cre = self.company_id.fe_webpos_id     
+    def _get_api_credentials(self):
+        """Return the webpos_api credentials of the active environment of the company."""
+        cre = self.company_id.fe_webpos_id
         cre = cre.filtered(lambda p: p.active)
         if not cre:
             raise UserError(_('No hay ambiente activo configurado en esta compañia.'))
-         
-        api_credentials = {
+
+        return {
             'url_base': cre.url_base,
             'name': cre.name,
             'companyLicCod': cre.companyLicCod,
             'apk': cre.apk,
         }
+
+    def _get_idempotency_key(self, content):
+        """Stable key of a submission: same document and same content (XML or
+        invoice payload) give the same key.
+
+        It does not depend on the record id, so a document recreated by a
+        retried transaction is still recognized by webpos_api.
+        """
+        self.ensure_one()
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        source = f'{self.company_id.id}|{self.account_move_id.id}|{self.name}|{content_hash}'
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def _apply_send_response(self, response_data, idempotency_key):
+        """Update the record from a send_xml result."""
+        self.ensure_one()
+        if response_data.get('received') == True and response_data.get('accepted') == True:
+            self.write({
+                'status': 'sent',
+                'idempotency_key': idempotency_key,
+                'json_response_sent': json.dumps(response_data),
+            })
+            _logger.info("XML enviado exitosamente: %s", self.name)
+        else:
+            self.write({
+                'status': 'error',
+                'json_response_sent': json.dumps(response_data),
+                'dgi_err_msg': response_data.get("dgiErrMsg"),
+            })
+            _logger.error('Error al enviar XML: %s', response_data)
+
+    def save_and_send_xml(self):
+        ''' 
+        Refactored: Calls the webpos_api endpoint to send XML and updates the record with the response.
+        '''
+        api_credentials = self._get_api_credentials()
         xml_content = self.xml_data if self.xml_data else ""
         if not xml_content:
             raise UserError(_('No hay datos XML para enviar.'))
 
-        # Get the API URL from system parameters or use default
-        api_base_url = self.env['ir.config_parameter'].sudo().get_param('webpos_api.base_url', 'http://localhost:8069')
-        api_url = f'{api_base_url}/webpos_api/send_xml'
-        
-        # Prepare payload in JSON-RPC format
-        payload = {
-            'jsonrpc': '2.0',
-            'method': 'call',
-            'params': {
-                'xml_content': xml_content,
-                'api_credentials': api_credentials,
-            },
-            'id': self.id or 1,
-        }
-        
-        headers = {
-            'Content-Type': 'application/json',
+        idempotency_key = self._get_idempotency_key(xml_content)
+        if self.idempotency_key == idempotency_key and self.status in ('sent', 'procesed'):
+            # Este mismo XML ya fue aceptado, no se repite el envio
+            _logger.info("XML ya enviado, se omite el reenvio: %s", self.name)
+            return
+
+        client = self.env['webpos.api.client']
+        api_url = client._get_url('/webpos_api/send_xml')
+        params = {
+            'xml_content': xml_content,
+            'api_credentials': api_credentials,
+            'idempotency_key': idempotency_key,
         }
-        
-        try:
-            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            response_jsonrpc = response.json()
+
+        with self._track_event('send'):
+            try:
+                response_jsonrpc = client._post('/webpos_api/send_xml', params, idempotency_key=idempotency_key)
             
-            # Check for JSON-RPC errors
-            if 'error' in response_jsonrpc:
-                error_details = response_jsonrpc['error']
-                _logger.error('API returned JSON-RPC error: %s', error_details)
-                self.status = 'error'
-                raise UserError(_('API Error: %s') % error_details.get('message', 'Unknown JSON-RPC error'))
+                # Check for JSON-RPC errors
+                if 'error' in response_jsonrpc:
+                    error_details = response_jsonrpc['error']
+                    _logger.error('API returned JSON-RPC error: %s', error_details)
+                    self.status = 'error'
+                    raise UserError(_('API Error: %s') % error_details.get('message', 'Unknown JSON-RPC error'))
             
-            # Process result
-            response_data = response_jsonrpc.get('result', {})
+                # Process result
+                response_data = response_jsonrpc.get('result', {})
             
-            # Update record based on response
-            if response_data.get('received') == True and response_data.get('accepted') == True:
-                self.status = 'sent'
-                _logger.info("XML enviado exitosamente: %s", self.name)
-                self.json_response_sent = json.dumps(response_data)
-            else:
+                # Update record based on response
+                self._apply_send_response(response_data, idempotency_key)
+
+            except requests.exceptions.Timeout:
                 self.status = 'error'
-                self.json_response_sent = json.dumps(response_data)
-                _logger.error('Error al enviar XML: %s', response_data)
-                self.dgi_err_msg = response_data.get("dgiErrMsg")
-                
-        except requests.exceptions.Timeout:
-            self.status = 'error'
-            _logger.error('Timeout al enviar XML')
-            raise UserError(_('Timeout: La API no respondió en 30 segundos'))
-        except requests.exceptions.ConnectionError:
-            self.status = 'error'
-            _logger.error('Error de conexión con la API en %s', api_url)
-            raise UserError(_('Error de conexión: No se pudo conectar a la API en %s') % api_url)
-        except requests.exceptions.RequestException as e:
-            self.status = 'error'
-            _logger.error('Error en la conexión a la API: %s', str(e))
-            raise UserError(_('Error en la conexión a la API: %s') % str(e))
-        except json.JSONDecodeError as e:
-            self.status = 'error'
-            _logger.error('Respuesta JSON inválida de la API: %s', str(e))
-            raise UserError(_('Respuesta JSON inválida de la API'))
+                _logger.error('Timeout al enviar XML')
+                raise UserError(_('Timeout: La API no respondió en %s segundos') % client._get_timeouts()[1])
+            except requests.exceptions.ConnectionError:
+                self.status = 'error'
+                _logger.error('Error de conexión con la API en %s', api_url)
+                raise UserError(_('Error de conexión: No se pudo conectar a la API en %s') % api_url)
+            except requests.exceptions.RequestException as e:
+                self.status = 'error'
+                _logger.error('Error en la conexión a la API: %s', str(e))
+                raise UserError(_('Error en la conexión a la API: %s') % str(e))
+            except json.JSONDecodeError as e:
+                self.status = 'error'
+                _logger.error('Respuesta JSON inválida de la API: %s', str(e))
+                raise UserError(_('Respuesta JSON inválida de la API'))
           
     def verify_sent_encf(self):
         ''' 
@@ -228,120 +456,543 @@ class MyXMLData(models.Model):
         document_number = self.account_move_id.l10n_latam_document_number
         if not document_number:
             raise UserError("El número de documento no está definido.")
-        cre = self.company_id.fe_webpos_id     
-        cre = cre.filtered(lambda p: p.active)
-        if not cre:
-            raise UserError(_('No hay ambiente activo configurado en esta compañia.'))
-            
-        api_credentials = {
-            'url_base': cre.url_base,
-            'name': cre.name,
-            'companyLicCod': cre.companyLicCod,
-            'apk': cre.apk,
-        }
-        
-        # Get the API URL from system parameters or use default
-        api_base_url = self.env['ir.config_parameter'].sudo().get_param('webpos_api.base_url', 'http://localhost:8069')
-        api_url = f'{api_base_url}/webpos_api/verify_status'
-        
-        # Prepare payload in JSON-RPC format
-        payload = {
-            'jsonrpc': '2.0',
-            'method': 'call',
-            'params': {
-                'api_credentials': api_credentials,
-                'document_number': document_number,
-                'cufe': self.cufe or '',
-            },
-            'id': self.id or 1,
-        }
-        
-        headers = {
-            'Content-Type': 'application/json',
+        api_credentials = self._get_api_credentials()
+
+        client = self.env['webpos.api.client']
+        api_url = client._get_url('/webpos_api/verify_status')
+        params = {
+            'api_credentials': api_credentials,
+            'document_number': document_number,
+            'cufe': self.cufe or '',
+            # El PDF se pide solo cuando se abre (_ensure_pdf)
+            'include_pdf': False,
         }
-        
-        try:
-            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            response_jsonrpc = response.json()
+
+        with self._track_event('verify'):
+            try:
+                response_jsonrpc = client._post('/webpos_api/verify_status', params, rpc_id=self.id or 1)
+            
+                # Check for JSON-RPC errors
+                if 'error' in response_jsonrpc:
+                    error_details = response_jsonrpc['error']
+                    _logger.error('API returned JSON-RPC error: %s', error_details)
+                    self.status = 'error'
+                    raise UserError(_('API Error: %s') % error_details.get('message', 'Unknown JSON-RPC error'))
             
-            # Check for JSON-RPC errors
+                # Process result
+                response_data = response_jsonrpc.get('result')
+            
+                if response_data:
+                    _logger.info("XML verificado exitosamente: %s", self.name)
+                    self._apply_verify_response(response_data)
+                else:
+                    self.status = 'error'
+                    self.json_response = json.dumps(response_jsonrpc)
+                    _logger.error('No se recibieron datos en la respuesta de verificación')
+                
+            except requests.exceptions.Timeout:
+                self.status = 'error'
+                _logger.error('Timeout al verificar XML')
+                raise UserError(_('Timeout: La API no respondió en %s segundos') % client._get_timeouts()[1])
+            except requests.exceptions.ConnectionError:
+                self.status = 'error'
+                _logger.error('Error de conexión con la API en %s', api_url)
+                raise UserError(_('Error de conexión: No se pudo conectar a la API en %s') % api_url)
+            except requests.exceptions.RequestException as e:
+                self.status = 'error'
+                _logger.error('Error en la conexión a la API: %s', str(e))
+                raise UserError(_('Error en la conexión a la API: %s') % str(e))
+            except json.JSONDecodeError as e:
+                self.status = 'error'
+                _logger.error('Respuesta JSON inválida de la API: %s', str(e))
+                raise UserError(_('Respuesta JSON inválida de la API'))
+
+    # ------------------------------------------------------------------
+    # Cola de envio (outbox)
+    # ------------------------------------------------------------------
+
+    def _log_event(self, stage, latency_ms=None, error=None):
+        """Append a my.xml.data.event with the current state of each record."""
+        for record in self:
+            self.env['my.xml.data.event']._buffer_event(record, stage, latency_ms=latency_ms, error=error)
+
+    @contextmanager
+    def _track_event(self, stage):
+        """Time the wrapped call and log its event, also when it raises.
+
+        Setting ``event['skip']`` in the block drops the event, for calls
+        that turned out not to happen (e.g. an endpoint that does not exist).
+        """
+        event = {'skip': False}
+        started = time.monotonic()
+        error = None
+        try:
+            yield event
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if not event['skip']:
+                self._log_event(stage, latency_ms=int((time.monotonic() - started) * 1000), error=error)
+
+    def _trigger_outbox(self):
+        """Wake up the outbox cron so the queued jobs are drained right away."""
+        cron = self.env.ref('l10n_do_webpos_fe_base.ir_cron_webpos_outbox', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    def _lock_for_processing(self, statuses=None):
+        """Row-lock the job if it is still in one of ``statuses`` (any if None).
+
+        Returns False when another worker holds the row or already moved it
+        to a different status, so concurrent drains never process a job twice.
+        """
+        self.ensure_one()
+        query = "SELECT id FROM my_xml_data WHERE id = %s"
+        args = [self.id]
+        if statuses is not None:
+            query += " AND status IN %s"
+            args.append(tuple(statuses))
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute(query + " FOR UPDATE SKIP LOCKED", args)
+                locked = bool(self.env.cr.fetchone())
+        except psycopg2.errors.SerializationFailure:
+            return False
+        if locked:
+            self.invalidate_recordset()
+        return locked
+
+    def _generate_xml_batch(self):
+        """Fill ``xml_data`` of the jobs with a single batched generate_xml round trip."""
+        started = time.monotonic()
+        results = self.account_move_id._build_xml_batch()
+        latency_ms = int((time.monotonic() - started) * 1000)
+        unavailable = self.env['webpos.api.client']._is_circuit_open()
+        for job in self:
+            result = results.get(job.account_move_id.id) or {}
+            if result.get('xml_content'):
+                job.write({'xml_data': result['xml_content'], 'payload_fingerprint': result.get('fingerprint')})
+            else:
+                job.write({
+                    'status': 'contingency' if unavailable else 'error',
+                    'error': result.get('error') or _('No XML data was generated.'),
+                })
+            job._log_event('generate', latency_ms=latency_ms, error=result.get('error'))
+
+    @api.model
+    def _get_pipeline_mode(self):
+        """``split`` (generate_xml, send_xml, verify_status) or ``composite`` (process_document)."""
+        return self.env['ir.config_parameter'].sudo().get_param('webpos_api.pipeline_mode', 'split')
+
+    def _process_composite(self):
+        """Generate, send and verify the e-CF with a single /webpos_api/process_document call.
+
+        The invoice payload goes out once and the generated XML comes back
+        together with the send and verification results, so the XML never
+        travels back to webpos_api. Returns False when the composite endpoint
+        is not available, so the caller can use the split pipeline instead.
+        """
+        self.ensure_one()
+        invoice = self.account_move_id
+        invoice_data = invoice._prepare_invoice_data_for_api(invoice)
+        idempotency_key = self._get_idempotency_key(_canonical_json(invoice_data))
+        params = {
+            'invoice_data': invoice_data,
+            'type_document': invoice.doc_type_E(invoice),
+            'api_credentials': self._get_api_credentials(),
+            'document_number': invoice.l10n_latam_document_number,
+            'idempotency_key': idempotency_key,
+        }
+        with self._track_event('composite') as event:
+            try:
+                response_jsonrpc = self.env['webpos.api.client']._post(
+                    '/webpos_api/process_document', params, idempotency_key=idempotency_key)
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    _logger.warning('Endpoint compuesto no disponible, se usa el envio por pasos')
+                    event['skip'] = True
+                    return False
+                raise
+
             if 'error' in response_jsonrpc:
                 error_details = response_jsonrpc['error']
                 _logger.error('API returned JSON-RPC error: %s', error_details)
-                self.status = 'error'
                 raise UserError(_('API Error: %s') % error_details.get('message', 'Unknown JSON-RPC error'))
-            
-            # Process result
-            response_data = response_jsonrpc.get('result')
-            
-            if response_data:
-                self.status = 'procesed'
-                _logger.info("XML verificado exitosamente: %s", self.name)
-                self.json_response = json.dumps(response_data)
-                # Update fields from response
-                self.cufe = response_data.get('cufe')
-                self.doc_type = response_data.get('docType')
-                self.doc_date = response_data.get('docDate')
-                self.company_lic_cod = response_data.get('companyLicCod')
-                self.company_ruc = response_data.get('companyRuc')
-                self.branch_cod = response_data.get('branchCod')
-                self.pos_cod = response_data.get('posCod')
-                self.fe_number = response_data.get('feNumber')
-                self.authorized = response_data.get('authorized')
-                self.auth_number = response_data.get('authNumber')
-                self.auth_date = response_data.get('authDate')
-                self.pdf = response_data.get('pdf')
-                self.xml = response_data.get('xml')
-                self.date_rec = response_data.get('dateRec')
-                self.system_ref = response_data.get('system_ref')
-                self.doc_affected_ref = response_data.get('docAffectedRef')
-                self.sub_doc_type = response_data.get('subDocType')
-                self.qr_code = response_data.get('qrCode')
-                self.qr_l1 = response_data.get('qrL1')
-                self.qr_l2 = response_data.get('qrL2')
-                self.xml_webpos = response_data.get('xmlWebPOS')
-                self.sub_total = response_data.get('subTotal')
-                self.tax_total = response_data.get('taxTotal')
-                self.total = response_data.get('total')
-                self.sbt0 = response_data.get('sbt0')
-                self.sbt1 = response_data.get('sbt1')
-                self.sbt2 = response_data.get('sbt2')
-                self.sbt3 = response_data.get('sbt3')
-                self.tax1 = response_data.get('tax1')
-                self.tax2 = response_data.get('tax2')
-                self.tax3 = response_data.get('tax3')
-                self.dgi_resp = response_data.get('dgiResp')
-                self.dgi_err_msg = response_data.get('dgiErrMsg')
-                self.sts = response_data.get('sts')
-                self.dgi_sts = response_data.get('dgiSts')
-                self.dgi_status = response_data.get('dgiStatus')
+
+            response_data = response_jsonrpc.get('result') or {}
+            if not response_data.get('xml_content'):
+                raise UserError(response_data.get('error') or _('No XML data was generated.'))
+            self.write({
+                'xml_data': response_data['xml_content'],
+                'payload_fingerprint': self._get_payload_fingerprint(
+                    invoice_data, params['type_document'], invoice.company_id.webpos_xml_engine),
+            })
+            # Se guarda la clave del XML, la misma que calcula save_and_send_xml ante un reenvio
+            self._apply_send_response(response_data.get('send') or {},
+                                      self._get_idempotency_key(response_data['xml_content']))
+            if self.status == 'sent' and response_data.get('verify'):
+                self._apply_verify_response(response_data['verify'])
+            return True
+
+    def _process_outbox_job(self):
+        """Generate, send and verify the e-CF of a single outbox job."""
+        self.ensure_one()
+        invoice = self.account_move_id
+        if (not self.xml_data and self._get_pipeline_mode() == 'composite'
+                and invoice.company_id.webpos_xml_engine != 'local' and self._process_composite()):
+            if self.status == 'sent':
+                self._schedule_verify(reset=True)
+            return
+        if not self.xml_data:
+            with self._track_event('generate'):
+                xml_content, xml_name, fingerprint = invoice._build_xml_with_fingerprint(
+                    invoice, invoice.doc_type_E(invoice))
+                self.write({'xml_data': xml_content, 'payload_fingerprint': fingerprint})
+        self.save_and_send_xml()
+        if self.status == 'sent':
+            # La DGII procesa de forma asincrona, el estado lo consulta el cron de sondeo
+            self._schedule_verify(reset=True)
+
+    @api.model
+    def _cron_process_outbox(self, limit=None):
+        """Drain the pending and contingency e-CF jobs. Called from ir.cron.
+
+        Each job runs in its own savepoint and is committed on its own, so a
+        failing document is flagged as ``error`` without blocking the rest.
+        Jobs that fail because webpos_api is unreachable go to ``contingency``
+        instead, and are drained again once the circuit breaker closes.
+        """
+        client = self.env['webpos.api.client']
+        if client._is_circuit_open():
+            _logger.info('webpos_api en contingencia, se pospone el procesamiento de la cola')
+            return
+        if limit is None:
+            limit = int(self.env['ir.config_parameter'].sudo().get_param('webpos_api.outbox_batch_size', 50))
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        statuses = ['pending', 'contingency']
+        # Una factura devuelta a borrador o cancelada no se envia; al publicarse de nuevo reutiliza su trabajo
+        jobs = self.search([
+            ('status', 'in', statuses),
+            ('account_move_id', '!=', False),
+            ('account_move_id.state', '=', 'posted'),
+        ], order='id', limit=limit)
+
+        # Las facturas sin XML se generan en lote (p.ej. cierre de sesion POS)
+        to_generate = jobs.filtered(lambda job: not job._has_payload('xml_data'))
+        if to_generate and self._get_pipeline_mode() != 'composite':
+            to_generate._generate_xml_batch()
+            if auto_commit:
+                self.env.cr.commit()
+
+        for job in jobs:
+            if not job._lock_for_processing(statuses):
+                continue
+            # La factura pudo cambiar de estado despues de la busqueda
+            job.account_move_id.invalidate_recordset(['state'])
+            if job.account_move_id.state != 'posted':
+                _logger.info('Factura de %s no publicada, se omite el envio', job.name)
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    job._process_outbox_job()
+                    job.write({'error': False})
+            except Exception as e:
+                if client._is_unavailable_error(e):
+                    _logger.warning('webpos_api no disponible, documento %s en contingencia: %s', job.name, str(e))
+                    job.write({'status': 'contingency', 'error': str(e)})
+                else:
+                    _logger.error('Error procesando el documento electronico %s: %s', job.name, str(e))
+                    job.write({'status': 'error', 'error': str(e)})
+            job.write({
+                'queue_attempts': job.queue_attempts + 1,
+                'queue_last_date': fields.Datetime.now(),
+            })
+            if auto_commit:
+                self.env.cr.commit()
+        if len(jobs) == limit:
+            # Quedan mas documentos en cola
+            self._trigger_outbox()
+
+    # ------------------------------------------------------------------
+    # Sondeo de estado DGII
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _is_final_dgi_status(self, dgi_status):
+        return (dgi_status or '').replace(' ', '').lower() in self._DGI_FINAL_STATUSES
+
+    def _schedule_verify(self, reset=False):
+        """Plan the next status check with exponential backoff.
+
+        The delay starts at ``webpos_api.verify_initial_delay`` seconds and
+        doubles on each attempt up to ``webpos_api.verify_max_delay``.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        initial_delay = int(ICP.get_param('webpos_api.verify_initial_delay', 60))
+        max_delay = int(ICP.get_param('webpos_api.verify_max_delay', 6 * 3600))
+        now = fields.Datetime.now()
+        for record in self:
+            attempts = 0 if reset else record.verify_attempts
+            delay = min(initial_delay * 2 ** attempts, max_delay)
+            record.write({
+                'verify_attempts': attempts,
+                'next_verify_date': now + timedelta(seconds=delay),
+            })
+
+    @api.model
+    def _cron_poll_sent_status(self, limit=None):
+        """Verify the sent documents whose next check is due. Called from ir.cron.
+
+        Documents leave the poll as soon as DGII returns a final status; the
+        others are rescheduled with backoff until ``webpos_api.verify_max_attempts``.
+        """
+        if self.env['webpos.api.client']._is_circuit_open():
+            return
+        ICP = self.env['ir.config_parameter'].sudo()
+        if limit is None:
+            limit = int(ICP.get_param('webpos_api.verify_batch_size', 100))
+        max_attempts = int(ICP.get_param('webpos_api.verify_max_attempts', 20))
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        records = self.search([
+            ('status', '=', 'sent'),
+            '|', ('next_verify_date', '=', False), ('next_verify_date', '<=', fields.Datetime.now()),
+        ], order='next_verify_date, id', limit=limit)
+        records = records.filtered(lambda record: record._lock_for_processing(['sent']))
+        try:
+            with self.env.cr.savepoint():
+                records._verify_sent_encf_batch()
+        except Exception as e:
+            _logger.warning('Error verificando los documentos electronicos %s: %s', records.ids, str(e))
+        for record in records:
+            if record.status == 'sent':
+                record.verify_attempts += 1
+                if record.verify_attempts >= max_attempts:
+                    record.write({
+                        'status': 'error',
+                        'error': _('La DGII no devolvió un estado final después de %s verificaciones.') % record.verify_attempts,
+                    })
+                    record._log_event('verify', error=record.error)
+                else:
+                    record._schedule_verify()
             else:
-                self.status = 'error'
-                self.json_response = json.dumps(response_jsonrpc)
-                _logger.error('No se recibieron datos en la respuesta de verificación')
-                
-        except requests.exceptions.Timeout:
-            self.status = 'error'
-            _logger.error('Timeout al verificar XML')
-            raise UserError(_('Timeout: La API no respondió en 30 segundos'))
-        except requests.exceptions.ConnectionError:
-            self.status = 'error'
-            _logger.error('Error de conexión con la API en %s', api_url)
-            raise UserError(_('Error de conexión: No se pudo conectar a la API en %s') % api_url)
-        except requests.exceptions.RequestException as e:
-            self.status = 'error'
-            _logger.error('Error en la conexión a la API: %s', str(e))
-            raise UserError(_('Error en la conexión a la API: %s') % str(e))
-        except json.JSONDecodeError as e:
-            self.status = 'error'
-            _logger.error('Respuesta JSON inválida de la API: %s', str(e))
-            raise UserError(_('Respuesta JSON inválida de la API'))
+                record.next_verify_date = False
+        if auto_commit:
+            self.env.cr.commit()
+
+    def _prepare_verify_vals(self, response_data):
+        """Map a verify_status response to my.xml.data values."""
+        vals = {fname: response_data.get(key) for fname, key in self._VERIFY_RESPONSE_FIELDS.items()}
+        vals['json_response'] = json.dumps(response_data)
+        # Mientras la DGII no de un estado final el documento sigue en sondeo
+        vals['status'] = 'procesed' if self._is_final_dgi_status(vals['dgi_status']) else 'sent'
+        return vals
+
+    def _apply_verify_response(self, response_data):
+        """Apply a verify_status response with a single write of the changed fields only.
+
+        Re-verifying a document usually returns the same data; skipping the
+        unchanged values avoids the UPDATE and the recomputation of the
+        stored related fields on account.move.
+        """
+        self.ensure_one()
+        vals = self._prepare_verify_vals(response_data)
+        changed = {}
+        for fname, value in vals.items():
+            field = self._fields[fname]
+            if field.convert_to_cache(value, self, validate=False) != field.convert_to_cache(self[fname], self, validate=False):
+                changed[fname] = value
+        if changed:
+            self.write(changed)
+
+    def _verify_sent_encf_batch(self):
+        """Verify many documents with /webpos_api/verify_status_batch.
+
+        Documents are grouped per company (credentials) and sent in chunks of
+        ``webpos_api.verify_batch_size``, keyed by record id. When the batch
+        endpoint does not exist the chunk falls back to one call per document.
+        Connection errors are logged and the chunk is left untouched.
+        """
+        client = self.env['webpos.api.client']
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param('webpos_api.verify_batch_size', 100))
+        for company in self.company_id:
+            records = self.filtered(lambda r: r.company_id == company and r.account_move_id.l10n_latam_document_number)
+            if not records:
+                continue
+            api_credentials = records[0]._get_api_credentials()
+            for start in range(0, len(records), batch_size):
+                chunk = records[start:start + batch_size]
+                params = {
+                    'api_credentials': api_credentials,
+                    'documents': [{
+                        'key': record.id,
+                        'document_number': record.account_move_id.l10n_latam_document_number,
+                        'cufe': record.cufe or '',
+                    } for record in chunk],
+                    'include_pdf': False,
+                }
+                started = time.monotonic()
+                try:
+                    response_jsonrpc = client._post('/webpos_api/verify_status_batch', params)
+                except requests.exceptions.HTTPError as e:
+                    if e.response is None or e.response.status_code != 404:
+                        _logger.error('Error verificando documentos por lote: %s', str(e))
+                        chunk._log_event('verify', latency_ms=int((time.monotonic() - started) * 1000), error=str(e))
+                        continue
+                    _logger.warning('Verificacion por lote no disponible, se verifica uno por uno')
+                    for record in chunk:
+                        try:
+                            with self.env.cr.savepoint():
+                                record.verify_sent_encf()
+                        except UserError as error:
+                            _logger.warning('Error verificando el documento %s: %s', record.name, str(error))
+                    continue
+                except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+                    _logger.error('Error verificando documentos por lote: %s', str(e))
+                    chunk._log_event('verify', latency_ms=int((time.monotonic() - started) * 1000), error=str(e))
+                    continue
+                latency_ms = int((time.monotonic() - started) * 1000)
+
+                if 'error' in response_jsonrpc:
+                    _logger.error('API returned JSON-RPC error: %s', response_jsonrpc['error'])
+                    chunk._log_event('verify', latency_ms=latency_ms, error=str(response_jsonrpc['error']))
+                    continue
+
+                results = {
+                    document.get('key'): document
+                    for document in (response_jsonrpc.get('result') or {}).get('documents', [])
+                }
+                for record in chunk:
+                    response_data = results.get(record.id)
+                    if response_data:
+                        record._apply_verify_response(response_data)
+                        record._log_event('verify', latency_ms=latency_ms)
+
+    # ------------------------------------------------------------------
+    # Retencion y archivo
+    # ------------------------------------------------------------------
+
+    def _get_archive_bundle(self):
+        """The payloads moved to cold storage, as a JSON-serializable dict."""
+        self.ensure_one()
+        bundle = self.read(list(self._PAYLOAD_FIELDS), load=None)[0]
+        bundle.pop('id')
+        return bundle
+
+    def _clear_archived_payloads(self):
+        """Drop the payload attachments of archived documents; the PDF is only a cache."""
+        vals = dict.fromkeys(self._PAYLOAD_FIELDS.values(), False)
+        vals.update(pdf=False, pdf_size=0, pdf_cache_date=False)
+        self.write(vals)
+
+    @api.model
+    def _cron_archive_documents(self):
+        """Move old documents with a final DGII status to my.xml.data.archive. Called from ir.cron.
+
+        Documents created more than ``webpos_api.retention_days`` days ago
+        (0 disables the archive) are archived in batches of
+        ``webpos_api.archive_batch_size``. Their rows stay, so the invoices
+        keep their DGII status; only the payloads leave the hot tables.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        retention_days = int(ICP.get_param('webpos_api.retention_days', 365))
+        if retention_days <= 0:
+            return
+        batch_size = int(ICP.get_param('webpos_api.archive_batch_size', 500))
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        last_id = 0
+        while True:
+            documents = self.search([
+                ('status', '=', 'procesed'),
+                ('create_date', '<', cutoff),
+                ('archive_id', '=', False),
+                ('id', '>', last_id),
+            ], order='id', limit=batch_size)
+            if not documents:
+                break
+            last_id = documents[-1].id
+            to_archive = documents.filtered(lambda document: self._is_final_dgi_status(document.dgi_status))
+            if to_archive:
+                self.env['my.xml.data.archive']._archive_documents(to_archive)
+                _logger.info('Archivados %s documentos electronicos', len(to_archive))
+            if auto_commit:
+                self.env.cr.commit()
+            self.env.invalidate_all()
+
+    # ------------------------------------------------------------------
+    # PDF bajo demanda
+    # ------------------------------------------------------------------
+
+    def _fetch_pdf(self):
+        """Download the PDF of the document from webpos_api, without storing it."""
+        self.ensure_one()
+        document_number = self.account_move_id.l10n_latam_document_number
+        if not document_number:
+            raise UserError("El número de documento no está definido.")
+        params = {
+            'api_credentials': self._get_api_credentials(),
+            'document_number': document_number,
+            'cufe': self.cufe or '',
+            'include_pdf': True,
+        }
+        try:
+            response_jsonrpc = self.env['webpos.api.client']._post('/webpos_api/verify_status', params, rpc_id=self.id)
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            _logger.error('Error descargando el PDF de %s: %s', self.name, str(e))
+            raise UserError(_('No se pudo obtener el PDF desde la API: %s') % str(e))
+        pdf = (response_jsonrpc.get('result') or {}).get('pdf')
+        if not pdf:
+            raise UserError(_('La API no devolvió el PDF del documento %s.') % self.name)
+        return base64.b64decode(pdf)
+
+    def _ensure_pdf(self):
+        """Make sure the PDF is cached, fetching it on first access.
+
+        The access date drives the eviction of ``_cron_evict_pdf_cache``; it is
+        refreshed at most once an hour to avoid a write on every download.
+        """
+        now = fields.Datetime.now()
+        for record in self.sudo():
+            if not record.with_context(bin_size=True).pdf:
+                content = record._fetch_pdf()
+                record.write({
+                    'pdf': base64.b64encode(content),
+                    'pdf_size': len(content),
+                    'pdf_cache_date': now,
+                })
+            elif not record.pdf_cache_date or record.pdf_cache_date < now - timedelta(hours=1):
+                record.pdf_cache_date = now
+
+    @api.model
+    def _cron_evict_pdf_cache(self):
+        """Drop the least recently opened PDFs above ``webpos_api.pdf_cache_max_mb``. Called from ir.cron."""
+        max_mb = int(self.env['ir.config_parameter'].sudo().get_param('webpos_api.pdf_cache_max_mb', 1024))
+        self.env.cr.execute("SELECT COALESCE(SUM(pdf_size), 0) FROM my_xml_data WHERE pdf_size > 0")
+        excess = self.env.cr.fetchone()[0] - max_mb * 1024 * 1024
+        if excess <= 0:
+            return
+        self.env.cr.execute("""
+            SELECT id, pdf_size FROM my_xml_data
+             WHERE pdf_size > 0
+          ORDER BY pdf_cache_date NULLS FIRST, id
+        """)
+        to_evict = []
+        for record_id, size in self.env.cr.fetchall():
+            if excess <= 0:
+                break
+            to_evict.append(record_id)
+            excess -= size
+        self.browse(to_evict).write({'pdf': False, 'pdf_size': 0, 'pdf_cache_date': False})
+        _logger.info('Eliminados %s PDF de la cache de documentos electronicos', len(to_evict))
 
     def action_resend_xml(self):
         # Lógica para reenviar el XML
-
-        self.save_and_send_xml()
+        # El bloqueo evita que un doble clic envie el documento dos veces en paralelo
+        for record in self:
+            if not record._lock_for_processing():
+                raise UserError(_('El documento %s ya se está enviando.') % record.name)
+            record.save_and_send_xml()
 
     def action_verify_sent_encf(self):
         # Lógica para reenviar el XML
@@ -352,126 +1003,40 @@ class MyXMLData(models.Model):
         # For now, assuming it's running on the same server for testing.
         # Replace with the actual URL when deploying on a separate server.
         
-        # Get the API URL from system parameters or use default
-        api_base_url = self.env['ir.config_parameter'].sudo().get_param('webpos_api.base_url', 'http://localhost:8069')
-        api_url = f'{api_base_url}/webpos_api/generate_xml'
+        client = self.env['webpos.api.client']
+        api_url = client._get_url('/webpos_api/generate_xml')
 
         # Gather data from the current record and related records
         invoice = self.account_move_id
         if not invoice:
             raise UserError("No associated invoice record found.")
 
-        # Process invoice lines with additional tax and product information
-        processed_lines = []
-        for line in invoice.invoice_line_ids:
-            line_data = {
-                'name': line.name,
-                'price_unit': line.price_unit,
-                'quantity': line.quantity,
-                'discount': line.discount,
-                'price_subtotal': line.price_subtotal,
-                'price_total': line.price_total,
-                'product_id': {
-                    'id': line.product_id.id if line.product_id else False,
-                    'name': line.product_id.name if line.product_id else '',
-                    'default_code': line.product_id.default_code if line.product_id else '',
-                },
-                'currency_id': {
-                    'id': line.currency_id.id,
-                    'name': line.currency_id.name,
-                    'decimal_places': line.currency_id.decimal_places,
-                },
-                'tax_ids': []
-            }
-            
-            # Process tax information for each line
-            for tax in line.tax_ids:
-                tax_data = {
-                    'id': tax.id,
-                    'name': tax.name,
-                    'amount': tax.amount,
-                    'price_include': tax.price_include,
-                    'tax_scope': getattr(tax, 'tax_scope', ''),  # Use getattr in case field doesn't exist
-                }
-                line_data['tax_ids'].append(tax_data)
-            
-            processed_lines.append(line_data)
-
-        # Helper function to safely get and format date fields
-        def safe_date_format(date_obj):
-            if date_obj:
-                if isinstance(date_obj, (datetime, date)):
-                    return date_obj.strftime('%Y-%m-%d')
-                return str(date_obj)
-            return False
+        # Mismo payload que la generacion desde la factura (AccountMove._prepare_invoice_data_batch)
+        invoice_data_payload = invoice._prepare_invoice_data_for_api(invoice)
 
-        # Safely get NCF expiration date from invoice or journal
-        ncf_expiration_date = getattr(invoice, 'ncf_expiration_date', None) or getattr(invoice.journal_id, 'l10n_do_ncf_expiration_date', None)
-
-        # Construct the invoice_data dictionary for the API in the expected nested format
-        invoice_data_payload = {
-            'record': {
-                'invoice_date': safe_date_format(invoice.invoice_date),
-                'l10n_latam_document_number': invoice.l10n_latam_document_number or '',
-                'ncf_expiration_date': safe_date_format(ncf_expiration_date),
-                'partner_id': {
-                    'name': invoice.partner_id.name or '',
-                    'vat': invoice.partner_id.vat or '',
-                    'street': invoice.partner_id.street or '',
-                    'state_name': invoice.partner_id.state_id.name if invoice.partner_id.state_id else '',
-                    'country_name': invoice.partner_id.country_id.name if invoice.partner_id.country_id else '',
-                    'email': invoice.partner_id.email or '',
-                },
-                'currency_id': {
-                    'id': invoice.currency_id.id,
-                    'name': invoice.currency_id.name,
-                    'decimal_places': invoice.currency_id.decimal_places,
-                    'inverse_rate': invoice.currency_id.inverse_rate,
-                },
-                'company_id': {
-                    'fe_webpos_id': self._serialize_datetime_data(invoice.company_id.fe_webpos_id.read()) if invoice.company_id.fe_webpos_id else [],
-                },
-                'invoice_payments_widget': self._serialize_datetime_data(invoice.invoice_payments_widget),
-                'payment_ids': self._serialize_datetime_data(invoice.payment_ids.read()) if invoice.payment_ids else [],
-                'reversed_entry_id': invoice.reversed_entry_id.id if invoice.reversed_entry_id else False,
-                'debit_origin_id': invoice.debit_origin_id.id if invoice.debit_origin_id else False,
-                'withholded_itbis': getattr(invoice, 'withholded_itbis', 0.0),
-                'income_withholding': getattr(invoice, 'income_withholding', 0.0),
-                'aditional_info_invoice_header1': getattr(invoice, 'aditional_info_invoice_header1', ''),
-                'aditional_info_invoice_header2': getattr(invoice, 'aditional_info_invoice_header2', ''),
-            },
-            'lines': processed_lines,  # Use processed lines with tax information
-            'origin_document_data': False,
-            'current_user_login_data': False,
-        }
+        # Mismo tipo de documento que la generacion desde la factura
+        type_document = invoice.doc_type_E(invoice)
 
-        # Determine the document type based on the current record (self.name)
-        type_document = self.doc_type_E(self.name)
-
-        # Prepare the payload for the API request in JSON-RPC format
-        # Apply datetime serialization to the entire payload to ensure no datetime objects remain
-        payload = {
-            'jsonrpc': '2.0',
-            'method': 'call',
-            'params': {
-                'invoice_data': self._serialize_datetime_data(invoice_data_payload),
-                'type_document': type_document,
-            },
-            'id': self.id or 1,
+        params = {
+            'invoice_data': invoice_data_payload,
+            'type_document': type_document,
         }
+        fingerprint = self._get_payload_fingerprint(
+            invoice_data_payload, type_document, invoice.company_id.webpos_xml_engine)
+        if self._get_xml_for_fingerprint(fingerprint):
+            # La factura no cambio desde la ultima generacion: ni llamada a la API ni reenvio
+            _logger.info("Payload sin cambios para %s, se reutiliza el XML almacenado", self.name)
+            return
 
-        # Set proper headers
-        headers = {
-            'Content-Type': 'application/json',
-        }
+        if invoice.company_id.webpos_xml_engine == 'local':
+            xml_content, xml_name = self.env['webpos.ecf.engine']._build_xml(invoice, invoice_data_payload, type_document)
+            if not self._apply_rebuilt_xml(xml_content, fingerprint):
+                _logger.info("XML reconstruido sin cambios para %s, no se reenvía", self.name)
+            return
 
         try:
-            # Make the POST request to the webpos_api
-            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-
-            # Process the API response (which is also in JSON-RPC format)
-            response_jsonrpc = response.json()
+            # Make the JSON-RPC call to the webpos_api (the response is also in JSON-RPC format)
+            response_jsonrpc = client._post('/webpos_api/generate_xml', params, rpc_id=self.id or 1)
 
             # Check for JSON-RPC errors first
             if 'error' in response_jsonrpc:
@@ -487,8 +1052,10 @@ class MyXMLData(models.Model):
                 raise UserError(_('No result data received from XML generation API'))
 
             if response_data.get('xml_content'):
-                self.xml_data = response_data['xml_content']
-                _logger.info("XML generated successfully by webpos_api for record: %s", self.name)
+                if self._apply_rebuilt_xml(response_data['xml_content'], fingerprint):
+                    _logger.info("XML generated successfully by webpos_api for record: %s", self.name)
+                else:
+                    _logger.info("XML reconstruido sin cambios para %s, no se reenvía", self.name)
                 
                 # Optionally store the filename if provided
                 if response_data.get('xml_name'):
@@ -506,7 +1073,7 @@ class MyXMLData(models.Model):
 
         except requests.exceptions.Timeout:
             _logger.error('Timeout communicating with webpos_api')
-            raise UserError(_('Timeout error: XML generation API did not respond within 30 seconds'))
+            raise UserError(_('Timeout error: XML generation API did not respond within %s seconds') % client._get_timeouts()[1])
         except requests.exceptions.ConnectionError:
             _logger.error('Connection error communicating with webpos_api at %s', api_url)
             raise UserError(_('Connection error: Could not connect to XML generation API at %s') % api_url)
@@ -520,10 +1087,61 @@ class MyXMLData(models.Model):
             _logger.error('An unexpected error occurred during XML generation API call: %s', str(e))
             raise UserError(_('An unexpected error occurred during XML generation: %s') % str(e))
 
-    def doc_type_E(self,doc_string):
-        # Verificamos que el string tenga el formato esperado
-        if len(doc_string) >= 13:  # E + 10 dígitos
-            # Extraemos el segundo y tercer carácter (índices 1 y 2)
-            result = doc_string[1:3]  # Esto devuelve los caracteres en los índices 1 y 2
-            return result
-        return "FF"
\ No newline at end of file
+    @api.model
+    def _get_payload_fingerprint(self, invoice_data, type_document, engine):
+        """Stable hash of a generate_xml request and the XML ``engine`` of the company."""
+        canonical = _canonical_json({'invoice_data': invoice_data, 'type_document': type_document, 'engine': engine})
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _get_xml_for_fingerprint(self, fingerprint):
+        """The stored XML if it was generated from the payload ``fingerprint``, else False."""
+        if len(self) != 1 or not fingerprint or self.payload_fingerprint != fingerprint:
+            return False
+        return self._has_payload('xml_data') and self.xml_data
+
+    def _apply_rebuilt_xml(self, xml_content, fingerprint=False):
+        """Store a rebuilt XML only if it differs from the current one.
+
+        ``fingerprint`` is the payload fingerprint ``xml_content`` was
+        generated from; it is written together with the XML.
+
+        Identical content (same sha256) is neither written nor resent. A new
+        content keeps the previous XML as a reverse delta in
+        my.xml.data.version. Only documents not yet sent (``pending``,
+        ``error``, ``contingency``) are queued for sending again: a ``sent``
+        or ``procesed`` e-CF is already with the DGII and is never resubmitted.
+        Returns whether the XML changed.
+        """
+        self.ensure_one()
+        new_hash = _hash_payload(xml_content)
+        old_xml = self.xml_data
+        if old_xml and not self.xml_hash:
+            # Documentos anteriores al hash: se calcula del XML almacenado
+            self.xml_hash = _hash_payload(old_xml)
+        if new_hash == self.xml_hash:
+            # Mismo XML: el payload nuevo lo produce igual que el anterior
+            if fingerprint:
+                self.payload_fingerprint = fingerprint
+            return False
+        if old_xml:
+            self.env['my.xml.data.version']._create_version(self, old_xml, xml_content)
+        if self.status not in self._REQUEUE_STATUSES:
+            _logger.info("XML de %s reconstruido en estado %s, no se reenvía", self.name, self.status)
+            self.write({'xml_data': xml_content, 'payload_fingerprint': fingerprint})
+            return True
+        self.write({
+            'xml_data': xml_content,
+            'payload_fingerprint': fingerprint,
+            'status': 'pending',
+            'error': False,
+            'queue_attempts': 0,
+        })
+        self._trigger_outbox()
+        return True
+
+    def doc_type_E(self, doc_string):
+        """WebPOS API document type of the NCF ``doc_string`` (see ``AccountMove.doc_type_E``)."""
+        invoice = self.account_move_id if len(self) == 1 else self.env['account.move']
+        if invoice:
+            return invoice.doc_type_E(invoice)
+        return self.env['account.move']._resolve_api_document_type(doc_string)
@@ -0,0 +1,110 @@
+import json
+import logging
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+from .my_xml_data import _compress_payload, _decompress_payload
+
+_logger = logging.getLogger(__name__)
+
+
+class MyXMLDataArchive(models.Model):
+    _name = 'my.xml.data.archive'
+    _description = 'Histórico archivado de documentos XML'
+    _order = 'doc_date desc, id desc'
+
+    # Solo identificadores y totales, el resto del documento va en payload_file
+    name = fields.Char(string='Name', index=True, readonly=True)
+    document_id = fields.Many2one('my.xml.data', string='Documento', index=True, readonly=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Company', index=True, readonly=True)
+    account_move_id = fields.Many2one('account.move', string='Cuenta de Movimiento', index=True, readonly=True)
+    cufe = fields.Char(string='CUFE', index=True, readonly=True)
+    doc_type = fields.Char(string='Tipo de Documento', readonly=True)
+    doc_date = fields.Date(string='Fecha de Documento', readonly=True)
+    fe_number = fields.Char(string='Número FE', readonly=True)
+    auth_number = fields.Char(string='Número de Autorización', readonly=True)
+    dgi_status = fields.Char(string='Estado DGI (Texto)', readonly=True)
+    sub_total = fields.Float(string='Subtotal', readonly=True)
+    tax_total = fields.Float(string='Total de ITBIS', readonly=True)
+    total = fields.Float(string='Monto Total', readonly=True)
+    archive_date = fields.Datetime(string='Fecha de archivo', readonly=True)
+    payload_file = fields.Binary(string='Documento archivado', attachment=True, readonly=True)
+
+    # Campos de my.xml.data copiados a las columnas del archivo
+    _SUMMARY_FIELDS = (
+        'name', 'company_id', 'account_move_id', 'cufe', 'doc_type', 'doc_date', 'fe_number',
+        'auth_number', 'dgi_status', 'sub_total', 'tax_total', 'total',
+    )
+
+    @api.model
+    def _archive_documents(self, documents):
+        """Move the payloads of ``documents`` (my.xml.data) into the archive.
+
+        The payloads are bundled as a gzip JSON document in the filestore
+        (cold storage) and their attachments are dropped. The slim
+        my.xml.data row stays, with its status, events and versions, so the
+        invoices linked to it are left untouched.
+        """
+        summaries = documents.read(list(self._SUMMARY_FIELDS), load=None)
+        vals_list = []
+        for document, summary in zip(documents, summaries):
+            summary.pop('id')
+            vals_list.append(dict(
+                summary,
+                document_id=document.id,
+                archive_date=fields.Datetime.now(),
+                payload_file=_compress_payload(json.dumps(document._get_archive_bundle(), default=str)),
+            ))
+        archives = self.create(vals_list)
+        documents._clear_archived_payloads()
+        for document, archive in zip(documents, archives):
+            document.archive_id = archive
+        return archives
+
+    def _get_payloads(self):
+        """The archived payloads ``{fname: text}``."""
+        self.ensure_one()
+        return json.loads(_decompress_payload(self.with_context(bin_size=False).payload_file) or '{}')
+
+    def _restore_document(self):
+        """Rehydrate the my.xml.data document from its cold storage bundle.
+
+        Reading the archive and the document is enough to restore it: the
+        write and the removal of the bundle, the only copy of the payloads
+        until then, are done as superuser.
+        """
+        self.ensure_one()
+        document = self.document_id
+        for record in (self, document):
+            record.check_access_rights('read')
+            record.check_access_rule('read')
+        bundle = self._get_payloads()
+        payload_fields = document._PAYLOAD_FIELDS
+        # Un payload reescrito despues del archivo (p.ej. una reconstruccion) tiene prioridad
+        vals = {
+            fname: bundle[fname] for fname in payload_fields
+            if bundle.get(fname) and not document.with_context(bin_size=True)[payload_fields[fname]]
+        }
+        vals['archive_id'] = False
+        document.sudo().write(vals)
+        self.sudo().unlink()
+        return document
+
+    def action_restore(self):
+        """Restore the document on demand and open it."""
+        if not self:
+            raise UserError(_('No hay documentos para restaurar.'))
+        documents = self.env['my.xml.data']
+        for archive in self:
+            documents |= archive._restore_document()
+        action = {
+            'type': 'ir.actions.act_window',
+            'res_model': 'my.xml.data',
+            'name': _('Documentos restaurados'),
+        }
+        if len(documents) == 1:
+            action.update(view_mode='form', res_id=documents.id)
+        else:
+            action.update(view_mode='tree,form', domain=[('id', 'in', documents.ids)])
+        return action
@@ -0,0 +1,91 @@
+from odoo import models, fields, api
+from odoo.tools import split_every
+
+
+class MyXMLDataEvent(models.Model):
+    _name = 'my.xml.data.event'
+    _description = 'Evento de estado de un documento XML'
+    _order = 'date desc, id desc'
+    # Tabla estrecha de solo insercion: sin columnas create_uid/write_date
+    _log_access = False
+
+    _ERROR_SIZE = 256
+    _INSERT_BATCH_SIZE = 1000
+
+    # El historial sobrevive al documento: se conserva su nombre
+    document_id = fields.Many2one('my.xml.data', string='Documento', index=True,
+                                  ondelete='set null', readonly=True)
+    document_name = fields.Char(string='Nombre del documento', index=True, readonly=True)
+    date = fields.Datetime(string='Fecha', required=True, index=True, readonly=True)
+    stage = fields.Selection([
+        ('generate', 'Generación'),
+        ('send', 'Envío'),
+        ('verify', 'Verificación'),
+        ('composite', 'Proceso compuesto'),
+    ], string='Etapa', required=True, readonly=True)
+    status = fields.Selection(
+        lambda self: self.env['my.xml.data']._fields['status'].selection,
+        string='Status', readonly=True)
+    dgi_status = fields.Char(string='Estado DGI (Texto)', readonly=True)
+    latency_ms = fields.Integer(string='Latencia (ms)', readonly=True, group_operator='avg')
+    error = fields.Char(string='Error', readonly=True)
+
+    @api.model
+    def _buffer_event(self, document, stage, latency_ms=None, error=None):
+        """Queue an event of ``document``; the buffer is bulk inserted right before commit.
+
+        Failed events are also kept aside for a rollback of the whole
+        transaction (e.g. a manual resend raising a UserError), and then
+        written on their own cursor, see :meth:`_flush_failed_events`.
+        """
+        events = self.env.cr.precommit.data.get(self._name)
+        if events is None:
+            events = self.env.cr.precommit.data[self._name] = []
+            self.env.cr.precommit.add(self._flush_events)
+        row = (
+            document.id,
+            document.name,
+            fields.Datetime.now(),
+            stage,
+            document.status,
+            document.dgi_status,
+            latency_ms,
+            error[:self._ERROR_SIZE] if error else None,
+        )
+        events.append(row)
+        if error:
+            failed = self.env.cr.postrollback.data.get(self._name)
+            if failed is None:
+                failed = self.env.cr.postrollback.data[self._name] = []
+                self.env.cr.postrollback.add(self._flush_failed_events)
+            failed.append(row)
+
+    def _insert_events(self, cr, rows):
+        for batch in split_every(self._INSERT_BATCH_SIZE, rows):
+            cr.execute(
+                "INSERT INTO my_xml_data_event"
+                " (document_id, document_name, date, stage, status, dgi_status, latency_ms, error) VALUES "
+                + ", ".join(["%s"] * len(batch)),
+                batch,
+            )
+
+    def _flush_events(self):
+        self._insert_events(self.env.cr, self.env.cr.precommit.data.pop(self._name, []))
+
+    def _flush_failed_events(self):
+        """Write the failed events of a rolled back transaction on a new cursor.
+
+        Runs after the rollback, so no lock of that transaction is left. A
+        document created by the rolled back transaction no longer exists: its
+        events keep only the document name.
+        """
+        rows = self.env.cr.postrollback.data.pop(self._name, [])
+        if not rows:
+            return
+        with self.env.registry.cursor() as cr:
+            cr.execute("SELECT id FROM my_xml_data WHERE id IN %s", [tuple({row[0] for row in rows})])
+            existing = {document_id for document_id, in cr.fetchall()}
+            self._insert_events(cr, [
+                (row[0] if row[0] in existing else None,) + row[1:]
+                for row in rows
+            ])
@@ -0,0 +1,63 @@
+from odoo import models, fields, tools, _
+
+
+class MyXMLDataSummary(models.Model):
+    _name = 'my.xml.data.summary'
+    _description = 'Resumen de documentos XML'
+    _auto = False
+    _order = 'id desc'
+
+    # Vista SQL sobre my_xml_data con solo las columnas ligeras: las listas y
+    # busquedas no tocan los textos ni los adjuntos del documento completo
+    name = fields.Char(string='Name', readonly=True)
+    status = fields.Selection(
+        lambda self: self.env['my.xml.data']._fields['status'].selection,
+        string='Status', readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    account_move_id = fields.Many2one('account.move', string='Cuenta de Movimiento', readonly=True)
+    document_id = fields.Many2one('my.xml.data', string='Documento', readonly=True)
+    cufe = fields.Char(string='CUFE', readonly=True)
+    doc_type = fields.Char(string='Tipo de Documento', readonly=True)
+    doc_date = fields.Date(string='Fecha de Documento', readonly=True)
+    fe_number = fields.Char(string='Número FE', readonly=True)
+    dgi_status = fields.Char(string='Estado DGII (Texto)', readonly=True)
+    total = fields.Float(string='Monto Total', readonly=True)
+    queue_attempts = fields.Integer(string='Intentos de envío', readonly=True)
+    verify_attempts = fields.Integer(string='Verificaciones', readonly=True)
+    next_verify_date = fields.Datetime(string='Próxima verificación', readonly=True)
+    create_date = fields.Datetime(string='Creado el', readonly=True)
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE VIEW {self._table} AS (
+                SELECT id,
+                       id AS document_id,
+                       name,
+                       status,
+                       company_id,
+                       account_move_id,
+                       cufe,
+                       doc_type,
+                       doc_date,
+                       fe_number,
+                       dgi_status,
+                       total,
+                       queue_attempts,
+                       verify_attempts,
+                       next_verify_date,
+                       create_date
+                  FROM my_xml_data
+            )
+        """)
+
+    def action_open_document(self):
+        """Open the full my.xml.data record behind the summary row."""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'my.xml.data',
+            'name': _('Documento XML'),
+            'view_mode': 'form',
+            'res_id': self.document_id.id,
+        }
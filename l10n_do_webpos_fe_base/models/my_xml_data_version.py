@@ -0,0 +1,81 @@
+import difflib
+import json
+import re
+
+from odoo import models, fields, api
+
+from .my_xml_data import _compress_payload, _decompress_payload
+
+# Corte despues de cada '>': el XML e-CF viene en una sola linea, un diff por lineas no ahorraria nada
+_TAG_BOUNDARY = re.compile(r'(?<=>)')
+
+
+def _split_tags(text):
+    return [token for token in _TAG_BOUNDARY.split(text) if token]
+
+
+def _reverse_delta(old, new):
+    """Delta that rebuilds ``old`` from ``new``, split on tag boundaries.
+
+    Returns ``{'split': 'tags', 'ops': [...]}``: ``[i, j]`` copies tokens
+    ``i:j`` of ``new``; ``['', [...]]`` inserts those tokens of ``old`` as is.
+    """
+    old_tokens = _split_tags(old)
+    new_tokens = _split_tags(new)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, new_tokens, old_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 != j2:
+            ops.append(['', old_tokens[j1:j2]])
+    return {'split': 'tags', 'ops': ops}
+
+
+def _apply_reverse_delta(new, delta):
+    new_tokens = _split_tags(new)
+    parts = []
+    for op in delta['ops']:
+        if op[0] == '':
+            parts.extend(op[1])
+        else:
+            parts.extend(new_tokens[op[0]:op[1]])
+    return ''.join(parts)
+
+
+class MyXMLDataVersion(models.Model):
+    _name = 'my.xml.data.version'
+    _description = 'Versión anterior del XML de un documento'
+    _order = 'id desc'
+
+    document_id = fields.Many2one('my.xml.data', string='Documento', required=True, index=True, ondelete='cascade')
+    xml_hash = fields.Char(string='Hash XML', readonly=True)
+    delta_size = fields.Integer(string='Tamaño delta', readonly=True)
+    # Delta inverso contra la version siguiente (la mas reciente es el xml_data actual)
+    delta_file = fields.Binary(string='Delta', attachment=True, readonly=True)
+    xml_data = fields.Text(string='XML Data', compute='_compute_xml_data')
+
+    @api.model
+    def _create_version(self, document, old_xml, new_xml):
+        """Keep ``old_xml`` of ``document`` as a reverse delta against ``new_xml``."""
+        delta = json.dumps(_reverse_delta(old_xml, new_xml), separators=(',', ':'))
+        blob = _compress_payload(delta)
+        return self.create({
+            'document_id': document.id,
+            'xml_hash': document.xml_hash,
+            'delta_size': len(blob),
+            'delta_file': blob,
+        })
+
+    @api.depends('delta_file')
+    def _compute_xml_data(self):
+        for version in self:
+            # Se reconstruye desde el XML actual aplicando los deltas de la mas reciente hacia atras
+            newer = self.search([
+                ('document_id', '=', version.document_id.id),
+                ('id', '>=', version.id),
+            ], order='id desc')
+            xml = version.document_id.xml_data or ''
+            for delta in newer.with_context(bin_size=False).mapped('delta_file'):
+                xml = _apply_reverse_delta(xml, json.loads(_decompress_payload(delta)))
+            version.xml_data = xml
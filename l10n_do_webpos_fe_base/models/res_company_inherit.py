@@ -3,4 +3,9 @@ from odoo import models, fields
 class ResCompany(models.Model):
     _inherit = 'res.company'
 
-    fe_webpos_id = fields.One2many('itx.fe.webpos', 'company_id', string="Web POS Credentials")
\ No newline at end of file
+    fe_webpos_id = fields.One2many('itx.fe.webpos', 'company_id', string="Web POS Credentials")
+    # El XML local no sale a la red; el envio y la verificacion siguen en webpos_api
+    webpos_xml_engine = fields.Selection([
+        ('webpos_api', 'webpos_api'),
+        ('local', 'Local'),
+    ], string="Generador de XML e-CF", default='webpos_api', required=True)
\ No newline at end of file
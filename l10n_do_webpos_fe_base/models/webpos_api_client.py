@@ -0,0 +1,220 @@
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from odoo import _, api, models
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_logger = logging.getLogger(__name__)
+
+
+def _json_default(obj):
+    """Encode the values the payloads carry that JSON has no type for.
+
+    Dates keep the formats webpos_api always received; recordsets are sent
+    as their list of ids.
+    """
+    if isinstance(obj, datetime):
+        return obj.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(obj, date):
+        return obj.strftime('%Y-%m-%d')
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, models.BaseModel):
+        return obj.ids
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _json_dumps(obj):
+    """Serialize ``obj`` to JSON bytes in a single pass, with orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+
+def _canonical_json(obj):
+    """JSON text of ``obj`` to hash: always the stdlib encoder, so hashes do not change with orjson."""
+    return json.dumps(obj, default=_json_default, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+# Una sesion por proceso (worker) y tamaño de pool, reutilizada entre peticiones
+# para mantener las conexiones keep-alive abiertas hacia webpos_api.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(pool_size):
+    session = _sessions.get(pool_size)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(pool_size)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({'Content-Type': 'application/json'})
+                _sessions[pool_size] = session
+    return session
+
+
+class WebposCircuitOpen(requests.exceptions.ConnectionError):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+class _CircuitBreaker:
+    """Per-process circuit breaker around webpos_api.
+
+    After ``threshold`` consecutive failures the circuit opens and every call
+    fails fast. Once ``reset_timeout`` seconds have passed a single trial call
+    is let through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def is_open(self, reset_timeout):
+        with self._lock:
+            return self.opened_at is not None and (
+                self.trial_running or time.monotonic() - self.opened_at < reset_timeout
+            )
+
+    def allow_request(self, reset_timeout):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < reset_timeout:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                _logger.info('webpos_api disponible nuevamente, se cierra el circuito')
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self, threshold):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= threshold:
+                if not self.trial_running:
+                    _logger.warning('webpos_api no disponible tras %s fallos, se abre el circuito', self.failures)
+                self.opened_at = time.monotonic()
+                self.trial_running = False
+
+    def release_trial(self):
+        """End a half-open trial whose outcome says nothing about availability."""
+        with self._lock:
+            self.trial_running = False
+
+
+_circuit = _CircuitBreaker()
+
+
+class WebposApiClient(models.AbstractModel):
+    _name = 'webpos.api.client'
+    _description = 'Cliente HTTP de webpos_api'
+
+    @api.model
+    def _get_param(self, key, default):
+        return self.env['ir.config_parameter'].sudo().get_param(key, default)
+
+    @api.model
+    def _get_base_url(self):
+        """Get the API base URL from system parameters"""
+        return self._get_param('webpos_api.base_url', 'http://localhost:8069')
+
+    @api.model
+    def _get_url(self, endpoint):
+        return f'{self._get_base_url()}{endpoint}'
+
+    @api.model
+    def _get_timeouts(self):
+        """Return the ``(connect, read)`` timeouts in seconds."""
+        return (
+            float(self._get_param('webpos_api.connect_timeout', 5)),
+            float(self._get_param('webpos_api.read_timeout', 30)),
+        )
+
+    @api.model
+    def _get_circuit_reset_timeout(self):
+        return float(self._get_param('webpos_api.circuit_reset_timeout', 60))
+
+    @api.model
+    def _is_circuit_open(self):
+        """Whether calls to webpos_api currently fail fast (contingency)."""
+        return _circuit.is_open(self._get_circuit_reset_timeout())
+
+    @api.model
+    def _is_unavailable_error(self, error):
+        """Whether ``error`` (or the exception it was raised from) means webpos_api is down."""
+        while error is not None:
+            if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                return True
+            if isinstance(error, requests.exceptions.HTTPError) \
+                    and error.response is not None and error.response.status_code >= 500:
+                return True
+            error = error.__cause__ or error.__context__
+        return False
+
+    @api.model
+    def _post(self, endpoint, params, rpc_id=1, idempotency_key=None):
+        """POST a JSON-RPC call to webpos_api through the pooled session.
+
+        Returns the decoded JSON-RPC response. ``requests`` exceptions are
+        left to the caller, which knows how to flag its own record. While the
+        circuit breaker is open :class:`WebposCircuitOpen` is raised at once.
+
+        ``idempotency_key`` is sent as the ``Idempotency-Key`` header and as
+        the JSON-RPC id, so webpos_api can drop repeated submissions.
+        """
+        url = self._get_url(endpoint)
+        if not _circuit.allow_request(self._get_circuit_reset_timeout()):
+            raise WebposCircuitOpen(_('webpos_api no disponible (contingencia), no se intentó la conexión a %s') % url)
+
+        session = _get_session(int(self._get_param('webpos_api.pool_size', 10)))
+        payload = {
+            'jsonrpc': '2.0',
+            'method': 'call',
+            'params': params,
+            'id': idempotency_key or rpc_id,
+        }
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        threshold = int(self._get_param('webpos_api.circuit_failure_threshold', 5))
+        try:
+            # El payload se codifica una sola vez, fechas incluidas (_json_default)
+            response = session.post(url, data=_json_dumps(payload), headers=headers, timeout=self._get_timeouts())
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code >= 500:
+                _circuit.record_failure(threshold)
+            else:
+                _circuit.record_success()
+            raise
+        except requests.exceptions.RequestException:
+            # Conexion, timeout, respuesta cortada (ChunkedEncodingError), redirecciones...
+            _circuit.record_failure(threshold)
+            raise
+        except Exception:
+            # Error local (p.ej. al codificar el payload): no cuenta como caida, pero
+            # la llamada de prueba del circuito semiabierto no puede quedar pendiente
+            _circuit.release_trial()
+            raise
+        _circuit.record_success()
+        return response.json()
@@ -0,0 +1,2 @@
+from . import test_payload_encoding
+from . import test_ecf_engine
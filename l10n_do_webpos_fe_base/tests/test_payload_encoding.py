@@ -0,0 +1,103 @@
+import json
+import logging
+import time
+from datetime import date, datetime
+
+from odoo.tests import BaseCase, tagged
+
+from odoo.addons.l10n_do_webpos_fe_base.models.webpos_api_client import _json_dumps
+
+_logger = logging.getLogger(__name__)
+
+
+def _legacy_serialize(data):
+    """The walker that converted dates before each json.dumps (MyXMLData._serialize_datetime_data)."""
+    if isinstance(data, (datetime, date)):
+        return data.strftime('%Y-%m-%d %H:%M:%S') if isinstance(data, datetime) else data.strftime('%Y-%m-%d')
+    elif isinstance(data, dict):
+        return {key: _legacy_serialize(value) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [_legacy_serialize(item) for item in data]
+    elif isinstance(data, tuple):
+        return tuple(_legacy_serialize(item) for item in data)
+    return data
+
+
+def _legacy_encode(invoice_data, type_document):
+    """Encoding work of the former generate_xml call: walker, two indented log dumps and the request body."""
+    invoice_data = _legacy_serialize(invoice_data)
+    api_data = {'invoice_data': invoice_data, 'type_document': type_document}
+    json.dumps(invoice_data, indent=2)
+    json.dumps(api_data, indent=2)
+    return json.dumps({'jsonrpc': '2.0', 'method': 'call', 'params': api_data, 'id': 1}).encode('utf-8')
+
+
+def _make_invoice_data(line_count):
+    """Payload shaped like ``AccountMove._prepare_invoice_data_batch`` for one invoice."""
+    currency = {'id': 1, 'name': 'DOP', 'decimal_places': 2, 'inverse_rate': 1.0}
+    taxes = [{'id': 1, 'name': 'ITBIS 18%', 'amount': 18.0, 'price_include': False, 'tax_scope': 'consu'}]
+    lines = [{
+        'name': f'Producto {index}',
+        'price_unit': 100.0 + index,
+        'quantity': 2.0,
+        'discount': 0.0,
+        'price_subtotal': 2 * (100.0 + index),
+        'price_total': 2 * (100.0 + index) * 1.18,
+        'product_id': {'id': index, 'name': f'Producto {index}', 'default_code': f'P{index:05d}'},
+        'currency_id': currency,
+        'tax_ids': taxes,
+    } for index in range(line_count)]
+    payments = [{
+        'id': index,
+        'name': f'PAGO/{index}',
+        'date': date(2024, 5, 1),
+        'amount': 1000.0,
+        'currency_id': (1, 'DOP'),
+        'journal_id': (1, 'Banco'),
+        'payment_type': 'inbound',
+        'type_payment_id': (1, 'Efectivo'),
+    } for index in range(3)]
+    record = {
+        'invoice_date': '2024-05-01',
+        'l10n_latam_document_number': 'E310000000001',
+        'ncf_expiration_date': '2025-12-31',
+        'partner_id': {'name': 'Cliente', 'vat': '101010101', 'street': 'Calle 1', 'state_name': '',
+                       'country_name': 'Dominican Republic', 'email': 'cliente@example.com'},
+        'currency_id': currency,
+        'company_id': {'fe_webpos_id': [{'name': 'Principal', 'companyLicCod': 'LIC', 'branchCod': '01', 'posCod': '01'}]},
+        'invoice_payments_widget': {'content': [
+            {'name': payment['name'], 'date': payment['date'], 'amount': payment['amount']} for payment in payments
+        ]},
+        'payment_ids': payments,
+        'reversed_entry_id': False,
+        'debit_origin_id': False,
+        'lines': lines,
+    }
+    return {'record': record, 'lines': lines, 'origin_document_data': False, 'current_user_login_data': False}
+
+
+@tagged('post_install', '-at_install', 'webpos_benchmark')
+class TestPayloadEncoding(BaseCase):
+    """Microbenchmark of the generate_xml payload encoding on a 500-line invoice."""
+
+    ROUNDS = 20
+
+    def _time(self, func):
+        started = time.perf_counter()
+        for _round in range(self.ROUNDS):
+            func()
+        return (time.perf_counter() - started) / self.ROUNDS
+
+    def test_single_pass_encoding(self):
+        invoice_data = _make_invoice_data(500)
+        payload = {'jsonrpc': '2.0', 'method': 'call',
+                   'params': {'invoice_data': invoice_data, 'type_document': 'FF'}, 'id': 1}
+
+        # Mismo JSON que antes: solo cambia el numero de pasadas
+        self.assertEqual(json.loads(_json_dumps(payload)), json.loads(_legacy_encode(invoice_data, 'FF')))
+
+        legacy = self._time(lambda: _legacy_encode(invoice_data, 'FF'))
+        single = self._time(lambda: _json_dumps(payload))
+        _logger.info('Codificacion de 500 lineas: anterior %.2f ms, una pasada %.2f ms (x%.1f)',
+                     legacy * 1000, single * 1000, legacy / single)
+        self.assertLess(single, legacy)